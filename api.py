@@ -1,7 +1,25 @@
 import model
+import bulk
+import cache
+import config
 import csv
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
 from datetime import datetime
+from cube import ScoreCube
+from functools import wraps
+from itertools import izip
+from multiprocessing.pool import ThreadPool
 from operator import itemgetter
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import joinedload, subqueryload_all
+
+log = logging.getLogger(__name__)
 
 
 """Error Handler"""
@@ -53,22 +71,119 @@ def create_teacher_user(user_type, email, password, first_name, last_name):
     return "Successfully Added!"
 
 
+"""Query Options"""
+
+# Loading strategies for the relationships reports walk, so that a report
+# costs the same number of queries however many rows it returns
+LOAD_STUDENT = (joinedload("student"),)
+LOAD_ROSTERS = (subqueryload_all("studentcohorts.student"),)
+
+def report_query(entity, *loads):
+    """Start a query for entity with the given loading strategies applied."""
+
+    query = entity.query
+    for load in loads:
+        query = query.options(*load)
+    return query
+
+
+"""Data Versions"""
+
+def get_data_version(teacher_id):
+    """Return the version of the teacher's classes, rosters, and scores."""
+
+    version = model.session.query(model.DataVersion.version).filter_by(teacher_id=teacher_id).scalar()
+    return version or 0
+
+def bump_data_version(teacher_id):
+    """Mark the teacher's data as changed, as part of the current transaction.
+    On Postgres this is one INSERT ... ON CONFLICT, so two uploads bumping a
+    teacher who has no version yet can't both insert it."""
+
+    if bulk.is_postgres(model.session):
+        model.session.execute("INSERT INTO dataversions (teacher_id, version) VALUES (:teacher_id, 1) "
+                              "ON CONFLICT (teacher_id) DO UPDATE SET version = dataversions.version + 1",
+                              {"teacher_id": teacher_id})
+        return
+
+    versions = model.DataVersion.__table__
+    result = model.session.execute(versions.update().where(versions.c.teacher_id == teacher_id).
+                                   values(version=versions.c.version + 1))
+    if result.rowcount == 0:
+        model.session.execute(versions.insert(), {"teacher_id": teacher_id, "version": 1})
+
+# IDs per query when looking up the teachers affected by a change
+VERSION_LOOKUP_CHUNK = 500
+
+def bump_shared_data_versions(cohort_ids, student_ids):
+    """Mark the data of the teachers who own some cohorts as changed, and of
+    every teacher with one of some students in a class. Students are matched
+    by name across teachers, so their reports read scores and classes that
+    other teachers upload."""
+
+    cohort_ids = list(cohort_ids)
+    student_ids = list(set(student_ids))
+
+    teacher_ids = set()
+    for i in range(0, len(cohort_ids), VERSION_LOOKUP_CHUNK):
+        chunk = cohort_ids[i:i + VERSION_LOOKUP_CHUNK]
+        teacher_ids.update(teacher_id for (teacher_id,) in
+                           model.session.query(model.Cohort.teacher_id).filter(model.Cohort.id.in_(chunk)))
+    for i in range(0, len(student_ids), VERSION_LOOKUP_CHUNK):
+        chunk = student_ids[i:i + VERSION_LOOKUP_CHUNK]
+        teacher_ids.update(teacher_id for (teacher_id,) in
+                           model.session.query(model.Cohort.teacher_id).
+                           join(model.StudentCohort, model.StudentCohort.cohort_id == model.Cohort.id).
+                           filter(model.StudentCohort.student_id.in_(chunk)).distinct())
+
+    # Bump in a fixed order so concurrent uploads don't deadlock
+    for teacher_id in sorted(teacher_ids):
+        if teacher_id is not None:
+            bump_data_version(teacher_id)
+
+
+"""Report Cache"""
+
+# Reports built for each teacher, at their current data version. Set
+# report_cache.shared to share them between server processes.
+report_cache = cache.ReportCache(config.REPORT_CACHE_SIZE)
+
+def cached_report(build):
+    """Serve a teacher report from report_cache, building it only when the
+    teacher's data has changed since it was last built. A report built with
+    a ReportContext is part of a larger report, which is cached instead.
+    Reports with parts that failed to build aren't cached."""
+
+    @wraps(build)
+    def cached(teacher_id, context=None):
+        if context is not None:
+            return build(teacher_id, context)
+
+        context = ReportContext()
+        version = get_data_version(teacher_id)
+        return report_cache.get_or_build(teacher_id, version, build.__name__, lambda: build(teacher_id, context),
+                                         lambda: not context.errors)
+
+    return cached
+
+
 """Settings"""
 
-def get_teacher_cohorts(teacher_id):
+@cached_report
+def get_teacher_cohorts(teacher_id, context=None):
     """Get teacher's cohorts and students in those cohorts from the db.
     Use teacher_id to get cohort_ids associated with that teacher and
     return them. If none, return False."""
 
-    # Get all teacher's cohorts
-    cohorts = model.Cohort.query.filter_by(teacher_id=teacher_id).all()
+    if context is None:
+        context = ReportContext()
 
     all_cohorts = []
 
     # For each class, add the ID, name, and list of students
-    for cohort in cohorts:
+    for cohort in context.cohorts(teacher_id):
         full_class = {}
-        students = get_students_in_cohort(cohort.id)
+        students = _student_names(cohort.studentcohorts)
         full_class["cohort_id"] = cohort.id
         full_class["name"] = cohort.name
         full_class["students"] = students
@@ -84,7 +199,12 @@ def get_students_in_cohort(cohort_id):
     to get student names for that cohort. If none, return False."""
 
     # Get all students associated with each of a teacher's cohort ID
-    students = model.StudentCohort.query.filter_by(cohort_id=cohort_id).all()
+    students = get_students_in_class(cohort_id)
+
+    return _student_names(students)
+
+def _student_names(students):
+    """List the name and ID of each student in a roster, sorted by name."""
 
     student_names = []
 
@@ -110,6 +230,7 @@ def add_new_cohort(name, teacher_id):
     if cohort == None:
         cohort = model.Cohort(name=name, teacher_id=teacher_id)
         model.session.add(cohort)
+        bump_data_version(teacher_id)
         model.session.commit()
         new_cohort = model.Cohort.query.filter_by(name=name).first()
         return new_cohort.id
@@ -141,11 +262,44 @@ def add_student_to_cohort(student_id, cohort_id):
 
     studentcohort = model.StudentCohort(student_id=student_id, cohort_id=cohort_id)
     model.session.add(studentcohort)
+    bump_shared_data_versions([cohort_id], [student_id])
     model.session.commit()
     return "Successfully Added!"
 
-def create_student_from_csv(csv_path, cohort_id, user_type):
-    """Parse CSV of new students and add each to users table in database."""
+def add_roster_to_cohort(cohort_id, students, user_type="student"):
+    """Add a roster of (first_name, last_name) pairs to a cohort in one
+    transaction. Missing users are created with one insert, and every student
+    not already in the cohort is linked to it with another. Return the
+    students' IDs in roster order."""
+
+    try:
+        # Find or create every student with set-based queries
+        student_ids = _get_student_ids([(last_name, first_name) for first_name, last_name in students], user_type)
+
+        # Link everyone who isn't already in the cohort
+        linked = set([student_id for (student_id,) in
+                      model.session.query(model.StudentCohort.student_id).filter_by(cohort_id=cohort_id)])
+        new_links = []
+        for student_id in student_ids:
+            if student_id not in linked:
+                new_links.append((student_id, cohort_id))
+                linked.add(student_id)
+        bulk.write_rows(model.session, model.StudentCohort.__table__, ("student_id", "cohort_id"), new_links)
+
+        if new_links:
+            bump_shared_data_versions([cohort_id], [student_id for student_id, link_cohort_id in new_links])
+        model.session.commit()
+
+    except:
+        model.session.rollback()
+        raise
+
+    return student_ids
+
+def create_student_from_csv(csv_path, cohort_id, user_type, progress=None):
+    """Parse CSV of new students and add them all to the users table and the
+    cohort in one transaction. If given, progress is called with the number
+    of rows read. Return the number of rows read."""
 
     # Read in CSV file of students
     with open(csv_path, 'rb') as f:
@@ -156,33 +310,125 @@ def create_student_from_csv(csv_path, cohort_id, user_type):
         # Skip header row
         headers = reader.next()
 
-        # Go through rows and add each student
+        # Collect each student's first and last name
+        students = []
         for row in reader:
             if row:
+                students.append((row[0], row[1]))
+
+    add_roster_to_cohort(cohort_id, students, user_type)
+
+    if progress:
+        progress(len(students))
+
+    return len(students)
 
-                # Check if student exists
-                student = model.User.query.filter_by(first_name=row[0], last_name=row[1]).first()
 
-                # If student doesn't exist, add student and add to student cohorts table
-                if student == None:
-                    user = model.User(user_type=user_type, first_name=row[0], last_name=row[1])
-                    model.session.add(user)
-                    model.session.commit()
+"""Standards Index"""
 
-                    # Get student's ID and add to studentcohorts table
-                    student_id = (model.User.query.filter_by(first_name=row[0], last_name=row[1]).first()).id
-                    studentcohort = model.StudentCohort(student_id=student_id, cohort_id=cohort_id)
-                    model.session.add(studentcohort)
-                    model.session.commit()
+# Process-wide map of standard code -> standard ID, loaded on first use
+_standard_ids = {}
+_standard_ids_loaded = False
+_standard_ids_lock = threading.Lock()
+
+def load_standards_index():
+    """Load the code and ID of every committed standard into the standards
+    index. This reads on its own connection, so standards the session has
+    added but not committed are left out."""
+
+    global _standard_ids_loaded
+
+    standards = model.engine.execute("SELECT code, id FROM standards ORDER BY id").fetchall()
+
+    with _standard_ids_lock:
+        _standard_ids.clear()
+
+        # Keep the lowest ID if a code was ever loaded twice
+        for code, standard_id in standards:
+            _standard_ids.setdefault(code, standard_id)
+        _standard_ids_loaded = True
+
+def reset_standards_index():
+    """Empty the standards index so it is reloaded on next use. Call this after
+    changing the standards table outside get_standard_id."""
+
+    global _standard_ids_loaded
+
+    with _standard_ids_lock:
+        _standard_ids.clear()
+        _standard_ids_loaded = False
+
+def get_standard_id(standard, new_standards=None):
+    """Match a standard cell ("CODE description") to the standards table using
+    the standards index, adding the standard if it doesn't exist yet. Return
+    its ID.
+
+    Standards that aren't in the index yet may only exist in this session's
+    transaction, so they are kept out of the shared index, which other
+    upload jobs read. They go in new_standards, a dict of code -> ID for the
+    transaction, which the caller passes to publish_standards once it has
+    committed."""
+
+    if not _standard_ids_loaded:
+        load_standards_index()
+
+    # Split standard on the space and only take the code
+    standard_split = standard.split(" ")
+    standard_code = standard_split[0]
+
+    standard_id = _standard_ids.get(standard_code)
+    if standard_id is None and new_standards is not None:
+        standard_id = new_standards.get(standard_code)
+    if standard_id is not None:
+        return standard_id
+
+    # Not in the index, so check the DB in case another process added it
+    standard = model.Standard.query.filter_by(code=standard_code).first()
+
+    # If the standard doesn't exist, add it to the DB
+    if standard == None:
+        categories = {'RF': 'Foundational Skills',
+                      'RI': 'Informational Text',
+                      'L': 'Language',
+                      'RL': 'Literature',
+                      'SL': 'Speaking and Listening',
+                      'W': 'Writing'}
+        cat_code = (standard_code.split("."))[0]
+        description = ' '.join(standard_split[1:])
+        standard = model.Standard(category=categories[cat_code], code=standard_code, description=description)
+        model.session.add(standard)
+        model.session.flush()
+
+    # Remember it so later rows in the transaction don't need to query
+    if new_standards is not None:
+        new_standards[standard_code] = standard.id
+
+    return standard.id
+
+def publish_standards(new_standards):
+    """Add the standards a transaction found or added with get_standard_id to
+    the standards index. Call this only after the transaction commits."""
+
+    with _standard_ids_lock:
+        if _standard_ids_loaded:
+            for code, standard_id in new_standards.items():
+                _standard_ids.setdefault(code, standard_id)
 
 
 """Reports"""
 
-def parse_CSV(csv_path, name, date, cohort_id):
+def parse_CSV(csv_path, name, date, cohort_id, use_bulk=True, progress=None):
     """Take CSV file that was uploaded and parse it. Create new test in Tests table.
     Match student names to users table and match CCSS to the standards table and
     get user_id and standard_id. Use test_id returned from create_new_test, user_id,
-    and standard_id, and add score to scores table."""
+    and standard_id, and add score to scores table.
+
+    Rows are streamed from the file and written in chunks of
+    config.INGEST_CHUNK_SIZE scores, so memory stays flat however large the
+    file is. Everything is written in one transaction. With use_bulk on a
+    Postgres engine each chunk is written with COPY; otherwise each score is
+    added through the ORM. If given, progress is called with the number of
+    scores written after each chunk. Return the new test's ID and score count."""
 
     # Format date object
     date = datetime.strptime(date, "%Y-%m-%d")
@@ -190,257 +436,900 @@ def parse_CSV(csv_path, name, date, cohort_id):
     # Open CSV file to read
     with open(csv_path, 'rb') as f:
 
-        # Create new test in tests database
-        test = model.Test(name=name, test_date=date, cohort_id=cohort_id)
-        model.session.add(test)
-        model.session.commit()
+        try:
+            # Create new test in tests database and flush to get its ID
+            test = model.Test(name=name, test_date=date, cohort_id=cohort_id)
+            model.session.add(test)
+            model.session.flush()
+
+            # Split at comma
+            reader = csv.reader(f, delimiter=',')
+
+            # Split the headers into student names and norm cohort names
+            students, norms = _parse_test_header(reader.next())
+            student_ids = _get_student_ids(students)
+
+            # Stream the standard rows into the scores and normscores tables
+            use_copy = use_bulk and bulk.is_postgres(model.session)
+            new_standards = {}
+            total = load_test_rows(test.id, student_ids, norms, _read_test_rows(reader), use_copy, progress,
+                                   new_standards)
+
+            test_id = test.id
+            bump_shared_data_versions([cohort_id], student_ids)
+            model.session.commit()
+
+        # Don't leave a half-loaded test behind
+        except:
+            model.session.rollback()
+            raise
+
+    # Only now can other jobs use any standards the test added
+    publish_standards(new_standards)
+
+    return {"test_id": test_id, "scores": total}
+
+def _parse_test_header(headers):
+    """Split the header row of a test file into a list of (last_name, first_name)
+    pairs and a list of norm cohort names."""
+
+    students = []
+    for student in headers[1:-2]:
+        # Split student on the comma to get the first and last name
+        student = student.split(",")
+        students.append((student[0].strip(), student[1].strip()))
+
+    norms = headers[-2:]
+
+    return students, norms
+
+def _read_test_rows(reader):
+    """Yield (standard, scores, norm_scores) for each non-empty row of a test file."""
+
+    for row in reader:
+        if row:
+            yield row[0], row[1:-2], row[-2:]
+
+def _get_student_ids(students, user_type="student"):
+    """Match (last_name, first_name) pairs to the users table, adding every
+    student who doesn't exist yet in one insert. Return IDs in the same order."""
 
-        # Split at comma
+    student_ids = {}
+    if not students:
+        return []
+
+    # Look up every name pair with one query, keeping the first match like .first()
+    users = model.session.query(model.User.last_name, model.User.first_name, model.User.id).\
+        filter(tuple_(model.User.last_name, model.User.first_name).in_(set(students))).\
+        order_by(model.User.id).all()
+    for last_name, first_name, user_id in users:
+        student_ids.setdefault((last_name, first_name), user_id)
+
+    # Add all the missing students at once and get their new IDs, keeping
+    # them in header order with a set to skip repeats
+    missing = []
+    seen = set()
+    for student in students:
+        if student not in student_ids and student not in seen:
+            seen.add(student)
+            missing.append(student)
+    new_rows = [(user_type, last_name, first_name) for last_name, first_name in missing]
+    inserted = bulk.insert_returning(model.session, model.User.__table__,
+                                     ("user_type", "last_name", "first_name"), new_rows)
+    for user_id, new_user_type, last_name, first_name in inserted:
+        student_ids[(last_name, first_name)] = user_id
+
+    return [student_ids[student] for student in students]
+
+def load_test_rows(test_id, student_ids, norms, rows, use_copy, progress=None, new_standards=None):
+    """Resolve each (standard, scores, norm_scores) row and write its scores,
+    normscores, and standard summary for the test, flushing every
+    config.INGEST_CHUNK_SIZE scores, then write each student's summary.
+    Report the running total to progress after each chunk. Standards are
+    resolved with get_standard_id, collecting new ones in new_standards.
+    Return the number of scores written."""
+
+    score_rows = []
+    norm_rows = []
+    summary_rows = []
+    student_counts = {}
+    total = 0
+
+    for standard, scores, norm_scores in rows:
+        if len(scores) != len(student_ids):
+            raise ValueError("Row for " + standard.split(" ")[0] + " has " + str(len(scores)) +
+                             " scores for " + str(len(student_ids)) + " students.")
+
+        # Scores are stored as their integer values
+        try:
+            values = [model.SCORE_VALUES[score] for score in scores]
+        except KeyError as e:
+            raise ValueError("Row for " + standard.split(" ")[0] + " has invalid score " + str(e) + ".")
+
+        standard_id = get_standard_id(standard, new_standards)
+
+        # Line up each score with its student, and each normscore with its cohort
+        for student_id, value in zip(student_ids, values):
+            score_rows.append((student_id, test_id, standard_id, value))
+        for cohort_name, norm_score in zip(norms, norm_scores):
+            norm_rows.append((cohort_name, test_id, standard_id, float(norm_score)))
+
+        # Summarize the row for the reports, and add it to each student's counts
+        for student_id, value in zip(student_ids, values):
+            counts = student_counts.setdefault(student_id, _empty_counts())
+            counts[value] += 1
+        falling_behind_ids = [student_id for student_id, value in zip(student_ids, values) if value == model.FALLING_BEHIND]
+        summary_rows.append((test_id, standard_id, values.count(model.MASTERED), values.count(model.ALMOST),
+                             len(falling_behind_ids), model.join_ids(falling_behind_ids)))
+
+        # Write out the chunk once it's full
+        if len(score_rows) >= config.INGEST_CHUNK_SIZE:
+            total += _write_scores(score_rows, norm_rows, summary_rows, use_copy)
+            score_rows = []
+            norm_rows = []
+            summary_rows = []
+            if progress:
+                progress(total)
+
+    total += _write_scores(score_rows, norm_rows, summary_rows, use_copy)
+
+    # Each student's counts are only complete once every row is read
+    student_rows = []
+    for student_id in student_ids:
+        if student_id in student_counts:
+            counts = student_counts.pop(student_id)
+            student_rows.append((test_id, student_id, counts[model.MASTERED], counts[model.ALMOST],
+                                 counts[model.FALLING_BEHIND]))
+    if use_copy:
+        bulk.copy_rows(model.session, model.StudentSummary.__table__, STUDENT_SUMMARY_COLUMNS, student_rows)
+    else:
+        bulk.insert_rows(model.session, model.StudentSummary.__table__, STUDENT_SUMMARY_COLUMNS, student_rows)
+
+    if progress:
+        progress(total)
+
+    return total
+
+# Columns of the summary rows built by load_test_rows
+SUMMARY_COLUMNS = ("test_id", "standard_id", "mastered", "almost", "falling_behind", "falling_behind_ids")
+STUDENT_SUMMARY_COLUMNS = ("test_id", "student_id", "mastered", "almost", "falling_behind")
+
+def _write_scores(score_rows, norm_rows, summary_rows, use_copy):
+    """Write a chunk of score, normscore, and standard summary rows, with COPY
+    or through the ORM. Return the number of scores written."""
+
+    # On Postgres, COPY the chunk in one go
+    if use_copy:
+        bulk.copy_rows(model.session, model.Score.__table__,
+                       ("student_id", "test_id", "standard_id", "score"), score_rows)
+        bulk.copy_rows(model.session, model.NormScore.__table__,
+                       ("cohort_name", "test_id", "standard_id", "score"), norm_rows)
+        bulk.copy_rows(model.session, model.StandardSummary.__table__, SUMMARY_COLUMNS, summary_rows)
+
+    # Otherwise fall back to adding each score through the ORM
+    else:
+        for student_id, test_id, standard_id, score in score_rows:
+            new_score = model.Score(student_id=student_id, test_id=test_id, standard_id=standard_id, score=score)
+            model.session.add(new_score)
+        for cohort_name, test_id, standard_id, score in norm_rows:
+            new_norm_score = model.NormScore(cohort_name=cohort_name, test_id=test_id, standard_id=standard_id, score=score)
+            model.session.add(new_norm_score)
+        for summary in summary_rows:
+            model.session.add(model.StandardSummary(**dict(zip(SUMMARY_COLUMNS, summary))))
+        model.session.flush()
+
+    return len(score_rows)
+
+def import_test_batch(path, teacher_id, cohort_id, date, use_bulk=True, progress=None):
+    """Import every test CSV in a zip archive or directory. The files are parsed
+    and validated in a process pool, then all the tests are written through the
+    same chunked writer as parse_CSV in one transaction, so nothing is saved
+    unless every file is valid.
+
+    An optional manifest.csv with columns file, test_name, test_date, cohort_id
+    overrides the name, date, and class of each file it lists. Otherwise the
+    test is named after the first cell of its file and uses date and cohort_id.
+    Every class must be one of teacher_id's. Return the new tests' IDs and the
+    total score count."""
+
+    # Unpack an archive into a temporary directory
+    temp_dir = None
+    if zipfile.is_zipfile(path):
+        temp_dir = tempfile.mkdtemp()
+        with zipfile.ZipFile(path) as archive:
+            archive.extractall(temp_dir)
+        path = temp_dir
+
+    try:
+        manifest = _read_test_manifest(path)
+        file_paths = _find_test_files(path)
+        if not file_paths:
+            raise ValueError("No CSV files were found to import.")
+
+        # Only write tests into the uploading teacher's own classes
+        own_cohort_ids = set(str(own_id) for (own_id,) in
+                             model.session.query(model.Cohort.id).filter_by(teacher_id=teacher_id))
+        errors = []
+        for file_path in file_paths:
+            file_name = os.path.basename(file_path)
+            test_cohort_id = manifest.get(file_name, (None, None, cohort_id))[2]
+            if str(test_cohort_id).strip() not in own_cohort_ids:
+                errors.append(file_name + ": class " + str(test_cohort_id) + " is not one of your classes.")
+        if errors:
+            raise ValueError("\n".join(errors))
+
+        # Parse and validate the files in parallel
+        pool = multiprocessing.Pool(min(len(file_paths), config.IMPORT_PROCESSES))
+        try:
+            test_files = pool.map(_parse_test_file, file_paths)
+        finally:
+            pool.close()
+            pool.join()
+
+        errors = []
+        for test_file in test_files:
+            errors.extend(test_file["errors"])
+        if errors:
+            raise ValueError("\n".join(errors))
+
+        use_copy = use_bulk and bulk.is_postgres(model.session)
+        new_standards = {}
+        test_ids = []
+        test_cohort_ids = set()
+        test_student_ids = set()
+        total = 0
+
+        try:
+            for test_file in test_files:
+                name, test_date, test_cohort_id = manifest.get(test_file["file"], (test_file["name"], date, cohort_id))
+
+                # Create the test and flush to get its ID
+                test = model.Test(name=name, test_date=datetime.strptime(test_date, "%Y-%m-%d"), cohort_id=test_cohort_id)
+                model.session.add(test)
+                model.session.flush()
+
+                # Report progress as a running total across all the files
+                file_progress = None
+                if progress:
+                    file_progress = lambda written, offset=total: progress(offset + written)
+
+                student_ids = _get_student_ids(test_file["students"])
+                total += load_test_rows(test.id, student_ids, test_file["norms"], test_file["rows"], use_copy,
+                                        file_progress, new_standards)
+                test_ids.append(test.id)
+                test_cohort_ids.add(test_cohort_id)
+                test_student_ids.update(student_ids)
+
+            # Every class that got a test, and every class of a student who
+            # took one, has new reports
+            bump_shared_data_versions(test_cohort_ids, test_student_ids)
+            model.session.commit()
+
+        # Don't leave half of a batch behind
+        except:
+            model.session.rollback()
+            raise
+
+        # Only now can other jobs use any standards the batch added
+        publish_standards(new_standards)
+
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir)
+
+    return {"test_ids": test_ids, "scores": total}
+
+def _find_test_files(path):
+    """List the test CSVs in a directory and its subdirectories, skipping the
+    manifest and any metadata added by the archiver."""
+
+    file_paths = []
+    for dir_path, dir_names, file_names in os.walk(path):
+        if "__MACOSX" in dir_path:
+            continue
+        for file_name in file_names:
+            if file_name.lower().endswith(".csv") and file_name != "manifest.csv" and not file_name.startswith("."):
+                file_paths.append(os.path.join(dir_path, file_name))
+
+    return sorted(file_paths)
+
+def _read_test_manifest(path):
+    """Read manifest.csv from the top of a batch, if there is one. Return a dict
+    of file name -> (test_name, test_date, cohort_id)."""
+
+    manifest = {}
+    manifest_path = os.path.join(path, "manifest.csv")
+    if not os.path.exists(manifest_path):
+        return manifest
+
+    with open(manifest_path, 'rb') as f:
+        for row in csv.DictReader(f):
+            manifest[row["file"]] = (row["test_name"], row["test_date"], row["cohort_id"])
+
+    return manifest
+
+def _parse_test_file(file_path):
+    """Read and validate one test file. This runs in a worker process, so it
+    returns plain data: the file name, the test name from the first header
+    cell, the students, norms, and rows, and a list of any errors found."""
+
+    file_name = os.path.basename(file_path)
+    test_file = {"file": file_name, "name": None, "students": [], "norms": [], "rows": [], "errors": []}
+    errors = test_file["errors"]
+
+    with open(file_path, 'rb') as f:
         reader = csv.reader(f, delimiter=',')
 
-        # Create list with the headers and filter it into student names list and norms list
-        headers = reader.next()
-        students = headers[1:-2]
-        norms = headers[-2:]
+        # Check the header has student names and two norm columns
+        headers = next(reader, [])
+        if len(headers) < 4:
+            errors.append(file_name + ": the first row should list students and two norm groups.")
+            return test_file
+        for student in headers[1:-2]:
+            if "," not in student:
+                errors.append(file_name + ": student name '" + student + "' should be LAST_NAME, FIRST_NAME.")
+        if errors:
+            return test_file
+
+        test_file["name"] = headers[0].strip()
+        test_file["students"], test_file["norms"] = _parse_test_header(headers)
+
+        # Check each row has a valid score for every student and numeric norms
+        for standard, scores, norm_scores in _read_test_rows(reader):
+            code = standard.split(" ")[0]
+            if len(scores) != len(test_file["students"]):
+                errors.append(file_name + ": row for " + code + " has " + str(len(scores)) + " scores for " +
+                              str(len(test_file["students"])) + " students.")
+                continue
+            invalid = set([score for score in scores if score not in model.SCORE_VALUES])
+            if invalid:
+                errors.append(file_name + ": row for " + code + " has invalid scores " + ", ".join(sorted(invalid)) + ".")
+            try:
+                [float(norm_score) for norm_score in norm_scores]
+            except ValueError:
+                errors.append(file_name + ": row for " + code + " has non-numeric norm scores.")
+            test_file["rows"].append((standard, scores, norm_scores))
+
+    return test_file
+
+"""Report Context"""
+
+class ReportContext(object):
+    """Data loaded once for all the reports built in one request: each
+    teacher's cohorts and their most recent tests, each cohort's ScoreCube,
+    tests, roster, and student summaries, each test's normscores, and each
+    student's classes. Report builders take
+    an optional context and load what they need through it, so builders run
+    together share a single query for each. A context can be shared by
+    builders running at once on the report pool; a builder that needs
+    something another is still loading waits for it."""
+
+    def __init__(self):
+        self._cohorts = {}
+        self._latest_test_ids = {}
+        self._standards = {}
+        self._cubes = {}
+        self._tests = {}
+        self._rosters = {}
+        self._student_counts = {}
+        self._norms = {}
+        self._student_cohorts = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+
+        # Names of the reports that failed to build
+        self.errors = []
+
+    def _load(self, loaded, key, load):
+        """Return loaded[key], calling load() to fill it in on first use."""
+
+        with self._lock:
+            if key in loaded:
+                return loaded[key]
+            key_lock = self._loading.setdefault((id(loaded), key), threading.Lock())
+
+        with key_lock:
+            if key not in loaded:
+                loaded[key] = load()
+        return loaded[key]
+
+    def cohorts(self, teacher_id):
+        """Return the teacher's cohorts, with their rosters loaded."""
+
+        return self._load(self._cohorts, teacher_id, lambda: report_query(model.Cohort, LOAD_ROSTERS).
+                          filter_by(teacher_id=teacher_id).order_by(model.Cohort.id).all())
+
+    def latest_test_ids(self, teacher_id):
+        """Return the IDs of the most recent test of each of the teacher's cohorts."""
 
-        # Read through the rest of the file and add the standards, scores, and normscores to lists
-        standards = []
-        scores = []
-        norm_scores = []
-        for row in reader:
-            if row:
-                standards.append(row[0])
-                scores.append(row[1:-2])
-                norm_scores.append(row[-2:])
-
-        # Create list of standard IDs
-        standard_ids = []
-        for standard in standards:
-
-            # Split standard on the space and only take the code
-            standard_split = standard.split(" ")
-            standard_code = standard_split[0]
-
-            # Query the DB using the code to see if the standard exists
-            standard = model.Standard.query.filter_by(code=standard_code).first()
-
-            # If the standard doesn't exist, add it to the DB
-            if standard == None:
-                categories = {'RF': 'Foundational Skills',
-                              'RI': 'Informational Text',
-                              'L': 'Language',
-                              'RL': 'Literature',
-                              'SL': 'Speaking and Listening',
-                              'W': 'Writing'}
-                cat_code = (standard_code.split("."))[0]
-                description = ' '.join(standard_split[1:])
-                stan = model.Standard(category=categories[cat_code], code=standard_code, description=description)
-                model.session.add(stan)
-                model.session.commit()
-
-                # Once it's added, get its ID and add to the standard IDs list
-                standard = model.Standard.query.filter_by(code=standard_code).first()
-                standard_id = standard.id
-                standard_ids.append(standard_id)
-
-            # If it already exists, get the ID and append it to the standard IDs list
-            standard_id = standard.id
-            standard_ids.append(standard_id)
-
-        # Create list of student IDs
-        student_ids = []
-        for student in students:
-            # Split student on the comma to get the first and last name
-            student = student.split(",")
-            last_name = student[0].strip()
-            first_name = student[1].strip()
-
-            # Query the DB matching on the first and last name
-            student = model.User.query.filter_by(last_name=last_name, first_name=first_name).first()
-
-            # If student doesn't exist, add student and get ID
-            if student == None:
-                student = model.User(user_type="student", first_name=first_name, last_name=last_name)
-                model.session.add(student)
-                model.session.commit()
-                student_id = (model.User.query.filter_by(last_name=last_name, first_name=first_name).first()).id
-            else:
-                student_id = student.id
-
-            # Add the ID to the student IDs list
-            student_ids.append(student_id)
-
-        # Get the ID of the test that was just created
-        test_id = (model.Test.query.filter_by(name=name).first()).id
-
-        # Iterate through the students, standards, and scores, and add the scores to the DB
-        j = 0
-        for student in student_ids:
-            i = 0
-            for standard in standard_ids:
-                score = scores[i][j]
-                new_score = model.Score(student_id=student, test_id=test_id, standard_id=standard, score=score)
-                model.session.add(new_score)
-                i += 1
-            j += 1
-
-        # Iterate through the students, standards, and normscores, and add the normscores to the DB
-        j = 0
-        for item in norms:
-            i = 0
-            for standard in standard_ids:
-                norm_score = norm_scores[i][j]
-                new_norm_score = model.NormScore(cohort_name=item, test_id=test_id, standard_id=standard, score=float(norm_score))
-                model.session.add(new_norm_score)
-                i += 1
-            j += 1
+        return self._load(self._latest_test_ids, teacher_id, lambda: get_most_recent_tests(self.cohorts(teacher_id)))
+
+    def summarize_standards(self, test_ids):
+        """Return _summarize_standards for some tests."""
+
+        return self._load(self._standards, tuple(test_ids), lambda: _summarize_standards(test_ids))
+
+    def cube(self, cohort_id):
+        """Return the cohort's ScoreCube, loading it on first use."""
+
+        return self._load(self._cubes, cohort_id, lambda: ScoreCube(cohort_id))
 
-        model.session.commit()
+    def tests(self, cohort_id):
+        """Return the cohort's tests in upload order."""
+
+        return self._load(self._tests, cohort_id, lambda: model.Test.query.filter_by(cohort_id=cohort_id).
+                          order_by(model.Test.id).all())
+
+    def latest_test(self, cohort_id):
+        """Return the cohort's most recent test by date, or None if it has none."""
 
-def get_most_recent_tests(cohorts):
+        tests = self.tests(cohort_id)
+        if not tests:
+            return None
+        return max(tests, key=lambda test: (test.test_date, test.id))
 
-    """Get most recent test IDs for a teacher ID"""
+    def roster(self, cohort_id):
+        """Return the cohort's studentcohorts in the order students joined,
+        with their students loaded."""
 
-    most_recent_tests = []
-    for cohort in cohorts:
-        test = model.Test.query.filter_by(cohort_id=cohort.id).order_by(model.Test.test_date.desc()).first()
-        most_recent_tests.append(test.id)
-    return most_recent_tests
+        return self._load(self._rosters, cohort_id, lambda: report_query(model.StudentCohort, LOAD_STUDENT).
+                          filter_by(cohort_id=cohort_id).order_by(model.StudentCohort.id).all())
+
+    def student_counts(self, cohort_id):
+        """Return {(student ID, test ID): {score value: count}} for the cohort's
+        tests, read from the student summaries instead of the scores."""
+
+        return self._load(self._student_counts, cohort_id, lambda: _load_student_counts(cohort_id))
+
+    def norms(self, test_id):
+        """Return the test's normscores in the order they were uploaded."""
+
+        return self._load(self._norms, test_id, lambda: model.NormScore.query.filter_by(test_id=test_id).
+                          order_by(model.NormScore.id).all())
 
-def all_cohorts_top_struggle_standards(teacher_id):
+    def load_student_cohorts(self, student_ids):
+        """Look up the classes of many students with one query."""
 
-    """Identify the top standards students are struggling with and which
-    students have not met those standards."""
+        with self._lock:
+            student_ids = [student_id for student_id in student_ids if student_id not in self._student_cohorts]
+        if not student_ids:
+            return
+
+        student_cohorts = dict((student_id, []) for student_id in student_ids)
+        for student_id, cohort_id in model.session.query(model.StudentCohort.student_id, model.StudentCohort.cohort_id).\
+                filter(model.StudentCohort.student_id.in_(student_ids)).order_by(model.StudentCohort.id):
+            student_cohorts[student_id].append(cohort_id)
 
-    scores_list = []
+        with self._lock:
+            for student_id, cohort_ids in student_cohorts.items():
+                self._student_cohorts.setdefault(student_id, cohort_ids)
 
-    cohorts = model.Cohort.query.filter_by(teacher_id=teacher_id).all()
+    def student_cohort_ids(self, student_id):
+        """Return the IDs of the student's classes, in the order they joined."""
 
-    most_recent_tests = get_most_recent_tests(cohorts)
+        self.load_student_cohorts([student_id])
+        return self._student_cohorts[student_id]
 
-    student_ids = []
-    standards_list = []
 
-    for cohort in cohorts:
-        students = cohort.studentcohorts
-        for student in students:
-            student_ids.append(student)
+def _load_student_counts(cohort_id):
+    counts = {}
+    summary = model.StudentSummary
+    for student_id, test_id, mastered, almost, falling_behind in model.session.query(
+            summary.student_id, summary.test_id, summary.mastered, summary.almost, summary.falling_behind).\
+            join(model.Test, model.Test.id == summary.test_id).filter(model.Test.cohort_id == cohort_id):
+        counts[(student_id, test_id)] = {model.MASTERED: mastered, model.ALMOST: almost,
+                                         model.FALLING_BEHIND: falling_behind}
+    return counts
 
-    for test_id in most_recent_tests:
-        scores = model.Score.query.filter_by(test_id=test_id, student_id=student_ids[0].student.id).all()
-        for score in scores:
-            standards_list.append(score.standard)
+def _add_counts(counts_list):
+    """Add up some {score value: count} dicts."""
+
+    total = _empty_counts()
+    for counts in counts_list:
+        for value in total:
+            total[value] += counts[value]
+    return total
+
+
+"""Report Pool"""
+
+_report_pool = None
+_report_pool_lock = threading.Lock()
+
+def _get_report_pool():
+    """Start the report pool on first use, so importing this module is free."""
+
+    global _report_pool
+
+    with _report_pool_lock:
+        if _report_pool is None:
+            _report_pool = ThreadPool(config.REPORT_WORKERS)
+    return _report_pool
+
+def fan_out(build, items, context):
+    """Yield build(item, context) for each item, in order, running the builds
+    at once on the report pool. Builders run this way share the context but
+    must not fan out themselves, or they could wait on the pool forever."""
+
+    return _get_report_pool().imap(lambda item: _run_report(build, item, context), items)
+
+def _run_report(build, item, context):
+    try:
+        return build(item, context)
+    finally:
+        # Each worker thread has its own scoped session; release it
+        model.session.remove()
+
+
+"""Score Aggregation"""
+
+# Columns each report dimension groups scores by
+SCORE_DIMENSIONS = {
+    "test": model.Score.test_id,
+    "standard": model.Score.standard_id,
+    "student": model.Score.student_id,
+    "cohort": model.Test.cohort_id,
+}
+
+# The same for each kind of summary: standard summaries have no per-student
+# counts, and student summaries no per-standard ones
+SUMMARY_DIMENSIONS = {
+    model.StandardSummary: {
+        "test": model.StandardSummary.test_id,
+        "standard": model.StandardSummary.standard_id,
+        "cohort": model.Test.cohort_id,
+    },
+    model.StudentSummary: {
+        "test": model.StudentSummary.test_id,
+        "student": model.StudentSummary.student_id,
+        "cohort": model.Test.cohort_id,
+    },
+}
+
+def _empty_counts():
+    return {model.MASTERED: 0, model.ALMOST: 0, model.FALLING_BEHIND: 0}
+
+def count_scores(dimension=None, test_ids=None, student_ids=None, cohort_ids=None):
+    """Count M/A/FB scores in the database with a single GROUP BY query,
+    optionally filtered to some tests, students, or cohorts. dimension is a
+    key of SCORE_DIMENSIONS, or None for one overall total. Counts are read
+    from the standard or student summaries unless they need both a student
+    and a standard.
+
+    Return a dict of dimension value (None for the overall total) ->
+    {score value: count}, with a count for each of model.SCORE_LABELS."""
+
+    # Nothing can match an empty filter, so skip the query
+    for ids in (test_ids, student_ids, cohort_ids):
+        if ids is not None and len(ids) == 0:
+            return {}
+
+    if student_ids is None and dimension != "student":
+        return _count_summaries(model.StandardSummary, dimension, test_ids, None, cohort_ids)
+    if dimension != "standard":
+        return _count_summaries(model.StudentSummary, dimension, test_ids, student_ids, cohort_ids)
+
+    key = SCORE_DIMENSIONS.get(dimension)
+    columns = [model.Score.score, func.count(model.Score.id)]
+    group_by = [model.Score.score]
+    if key is not None:
+        columns.insert(0, key)
+        group_by.insert(0, key)
+
+    query = model.session.query(*columns)
+
+    # Scores only know their cohort through their test
+    if dimension == "cohort" or cohort_ids is not None:
+        query = query.join(model.Test, model.Test.id == model.Score.test_id)
+        if cohort_ids is not None:
+            query = query.filter(model.Test.cohort_id.in_(cohort_ids))
+    if test_ids is not None:
+        query = query.filter(model.Score.test_id.in_(test_ids))
+    if student_ids is not None:
+        query = query.filter(model.Score.student_id.in_(student_ids))
+
+    counts = {}
+    for row in query.group_by(*group_by):
+        if key is not None:
+            value, score, count = row
+        else:
+            value = None
+            score, count = row
+
+        # Values other than M, A, and FB aren't counted
+        value_counts = counts.setdefault(value, _empty_counts())
+        if score in value_counts:
+            value_counts[score] = count
+
+    return counts
+
+def _count_summaries(summary, dimension, test_ids, student_ids, cohort_ids):
+    """Add up one kind of summary for count_scores, returning counts in the
+    same shape."""
+
+    key = SUMMARY_DIMENSIONS[summary].get(dimension)
+    columns = [func.sum(summary.mastered), func.sum(summary.almost), func.sum(summary.falling_behind)]
+    if key is not None:
+        columns.insert(0, key)
+
+    query = model.session.query(*columns)
+
+    # Summaries only know their cohort through their test
+    if dimension == "cohort" or cohort_ids is not None:
+        query = query.join(model.Test, model.Test.id == summary.test_id)
+        if cohort_ids is not None:
+            query = query.filter(model.Test.cohort_id.in_(cohort_ids))
+    if test_ids is not None:
+        query = query.filter(summary.test_id.in_(test_ids))
+    if student_ids is not None:
+        query = query.filter(summary.student_id.in_(student_ids))
+    if key is not None:
+        query = query.group_by(key)
+
+    counts = {}
+    for row in query:
+        if key is None:
+            row = (None,) + tuple(row)
+        value, mastered, almost, falling_behind = row
+
+        # An overall total over no summaries comes back as NULLs
+        if mastered is None:
+            continue
+        counts[value] = {model.MASTERED: int(mastered), model.ALMOST: int(almost),
+                         model.FALLING_BEHIND: int(falling_behind)}
+
+    return counts
+
+def _pie_chart(counts):
+    """Turn M/A/FB counts into the percentages the pie charts display."""
+
+    total = counts[model.MASTERED] + counts[model.ALMOST] + counts[model.FALLING_BEHIND]
+
+    # Nothing has been scored yet
+    if total == 0:
+        return [{"score": "M", "value": 0.0},
+                {"score": "A", "value": 0.0},
+                {"score": "FB", "value": 0.0}]
+
+    m_perc = (float(counts[model.MASTERED]) / float(total)) * 100
+    a_perc = (float(counts[model.ALMOST]) / float(total)) * 100
+    fb_perc = (float(counts[model.FALLING_BEHIND]) / float(total)) * 100
+
+    return [{"score": "M", "value": m_perc},
+            {"score": "A", "value": a_perc},
+            {"score": "FB", "value": fb_perc}]
+
+def _data_by_test(tests, counts):
+    """Build the by-test stacked bar data: an "All Tests" total followed by
+    the M/A/FB counts ("3"/"2"/"1") of each test in order."""
+
+    total_dict = {"name": "All Tests", "3": 0, "2": 0, "1": 0}
+    resp_list = [total_dict]
+
+    for test in tests:
+        test_counts = counts.get(test.id, _empty_counts())
+        resp_dict = {"name": test.name}
+        for value in model.SCORE_LABELS:
+            resp_dict[str(value)] = test_counts[value]
+
+            # Increment totals
+            total_dict[str(value)] += test_counts[value]
+        resp_list.append(resp_dict)
 
-    for standard in standards_list:
+    return resp_list
+
+def _summarize_standards(test_ids):
+    """Combine the standard summaries of some tests into one dict per standard
+    tested, in the order standards were uploaded: its "id", code ("name"),
+    and "description", its "counts" of each score value, and the
+    "falling_behind_ids" of students falling behind on it."""
+
+    if not test_ids:
+        return []
+
+    summaries = model.session.query(model.StandardSummary, model.Standard).\
+        join(model.Standard, model.Standard.id == model.StandardSummary.standard_id).\
+        filter(model.StandardSummary.test_id.in_(test_ids)).\
+        order_by(model.StandardSummary.id).all()
+
+    standards = []
+    by_standard = {}
+    for summary, standard in summaries:
+        if standard.id not in by_standard:
+            by_standard[standard.id] = {"id": standard.id, "name": standard.code, "description": standard.description,
+                                        "counts": _empty_counts(), "falling_behind_ids": []}
+            standards.append(by_standard[standard.id])
+
+        counts = by_standard[standard.id]["counts"]
+        counts[model.MASTERED] += summary.mastered
+        counts[model.ALMOST] += summary.almost
+        counts[model.FALLING_BEHIND] += summary.falling_behind
+        by_standard[standard.id]["falling_behind_ids"].extend(model.split_ids(summary.falling_behind_ids))
+
+    return standards
+
+def _get_student_names(student_ids):
+    """Look up the full names of some students with one query. Return a dict
+    of student ID -> name."""
+
+    names = {}
+    if student_ids:
+        for user_id, first_name, last_name in model.session.query(model.User.id, model.User.first_name, model.User.last_name).\
+                filter(model.User.id.in_(student_ids)):
+            names[user_id] = first_name + " " + last_name
+    return names
+
+def _falling_behind_names(standards):
+    """Look up the names of every student falling behind on some standards
+    from _summarize_standards."""
+
+    student_ids = set()
+    for standard in standards:
+        student_ids.update(standard["falling_behind_ids"])
+    return _get_student_names(list(student_ids))
+
+def _top_struggle_standards(standards, total_students, names):
+    """Build the top struggle standards report from _summarize_standards: for
+    each standard tested, the percentage of total_students who met it and the
+    sorted names of the students falling behind on it. Sorted from least to
+    most met."""
+
+    scores_list = []
+    for standard in standards:
         scores_by_standard = {}
-        scores_by_standard["name"] = standard.code
-        scores_by_standard["description"] = standard.description
-        scores_by_standard["id"] = standard.id
-        scores_by_standard["students"] = []
-        total_scores = len(student_ids)
-
-        for test_id in most_recent_tests:
-            m_count = 0
-            a_count = 0
-            fb_count = 0
-
-            scores = model.Score.query.filter_by(test_id=test_id, standard_id=standard.id).all()
-
-            for score in scores:
-                if score.score == "M":
-                    m_count += 1
-                elif score.score == "A":
-                    a_count += 1
-                elif score.score == "FB":
-                    fb_count += 1
-                    scores_by_standard["students"].append(score.student.first_name + " " + score.student.last_name)
-
-        m_percent = (float(m_count) / float(total_scores)) * 100
-        scores_by_standard["percent"] = m_percent
+        scores_by_standard["name"] = standard["name"]
+        scores_by_standard["description"] = standard["description"]
+        scores_by_standard["id"] = standard["id"]
+        scores_by_standard["students"] = sorted([names[student_id] for student_id in standard["falling_behind_ids"]])
+
+        # Calculate percentage of Ms
+        scores_by_standard["percent"] = 0.0
+        if total_students:
+            scores_by_standard["percent"] = (float(standard["counts"][model.MASTERED]) / float(total_students)) * 100
         scores_list.append(scores_by_standard)
-        scores_by_standard["students"].sort()
 
+    # Sort list of dicts by percent of Ms
     scores_list.sort(key=itemgetter("percent"))
 
     return scores_list
 
-def all_cohorts_pie_chart(teacher_id):
-    """Aggregate M/A/FB scores from most recent test for pie chart."""
+def _data_by_standard(standards):
+    """Build the by-standard stacked bar data from _summarize_standards: the
+    M/A/FB counts ("3"/"2"/"1") of each standard tested, from most to least
+    met."""
+
+    scores_list = []
+    for standard in standards:
+        scores_by_standard = {"name": standard["name"], "description": standard["description"], "id": standard["id"]}
+        for value in model.SCORE_LABELS:
+            scores_by_standard[str(value)] = standard["counts"][value]
+        scores_list.append(scores_by_standard)
 
-    # Create empty list to hold the score aggregation
-    summed_scores = []
+    # Sort list of dicts by count of Ms and reverse it
+    scores_list.sort(key=itemgetter(str(model.MASTERED)))
+    scores_list.reverse()
 
-    # Get all cohorts associated with the teacher
-    cohorts = model.Cohort.query.filter_by(teacher_id=teacher_id).all()
+    return scores_list
 
-    # Create an empty list to hold the most recent test for each cohort
-    most_recent_tests = []
+def _top_struggle_students(students, counts):
+    """Build the top struggle students report for a list of (student ID, name)
+    from their {score value: count}: the percentage of As and FBs across all
+    of each student's scores, from most to least struggling."""
+
+    scores_list = []
+
+    for student_id, name in students:
+        student_counts = counts.get(student_id, _empty_counts())
+        total_scores = sum(student_counts.values())
+
+        # Calculate percentages of As and FBs, which are zero until the
+        # student has been scored
+        a_percent = 0.0
+        fb_percent = 0.0
+        if total_scores:
+            a_percent = (float(student_counts[model.ALMOST]) / float(total_scores)) * 100
+            fb_percent = (float(student_counts[model.FALLING_BEHIND]) / float(total_scores)) * 100
+
+        # Add scores to dict, add dict to response list
+        scores_by_student = {}
+        scores_by_student["name"] = name
+        scores_by_student["A"] = a_percent
+        scores_by_student["FB"] = fb_percent
+        scores_by_student["total"] = a_percent + fb_percent
+        scores_list.append(scores_by_student)
+
+    # Sort and reverse list of dicts by total percentage of As and FBs
+    scores_list.sort(key=itemgetter("total"))
+    scores_list.reverse()
+
+    return scores_list
+
+def get_latest_tests(cohort_ids):
+    """Get the most recent test of each cohort with a single query, ranking
+    each cohort's tests by date with a window function. Return a dict of
+    cohort ID -> Test; cohorts without tests are left out."""
+
+    if not cohort_ids:
+        return {}
+
+    # Number each cohort's tests from newest to oldest
+    newest = func.row_number().over(partition_by=model.Test.cohort_id,
+                                    order_by=[model.Test.test_date.desc(), model.Test.id.desc()])
+    ranked = model.session.query(model.Test.id.label("id"), newest.label("newest")).\
+        filter(model.Test.cohort_id.in_(cohort_ids)).subquery()
+
+    # Keep only the newest test of each cohort
+    tests = model.Test.query.join(ranked, ranked.c.id == model.Test.id).filter(ranked.c.newest == 1).all()
 
-    # Query the tests database to retrieve the test ID of the most recent test for each cohort
+    return dict([(test.cohort_id, test) for test in tests])
+
+def get_most_recent_tests(cohorts):
+
+    """Get most recent test IDs for a teacher's cohorts, skipping any cohort
+    that has no tests yet."""
+
+    latest_tests = get_latest_tests([cohort.id for cohort in cohorts])
+
+    most_recent_tests = []
     for cohort in cohorts:
-        test = model.Test.query.filter_by(cohort_id=cohort.id).order_by(model.Test.test_date.desc()).first()
-        most_recent_tests.append(test.id)
+        if cohort.id in latest_tests:
+            most_recent_tests.append(latest_tests[cohort.id].id)
+    return most_recent_tests
 
-    m_total = 0
-    a_total = 0
-    fb_total = 0
+@cached_report
+def all_cohorts_top_struggle_standards(teacher_id, context=None):
 
-    # Loop through the most recent tests and get scores
-    for test_id in most_recent_tests:
-        scores = model.Score.query.filter_by(test_id=test_id).all()
+    """Identify the top standards students are struggling with and which
+    students have not met those standards."""
+
+    if context is None:
+        context = ReportContext()
+
+    most_recent_tests = context.latest_test_ids(teacher_id)
 
-        # Initialize counters at zero and make empty dict to hold final scores
-        m_count = 0
-        a_count = 0
-        fb_count = 0
+    # Count the students in all the teacher's cohorts
+    total_students = sum([len(cohort.studentcohorts) for cohort in context.cohorts(teacher_id)])
 
-        # Loop through score objects and get score value, append to list
-        for score in scores:
-            if score.score == 'M':
-                m_count +=1
-            elif score.score == 'A':
-                a_count +=1
-            elif score.score == 'FB':
-                fb_count += 1
+    standards = context.summarize_standards(most_recent_tests)
 
-        m_total += m_count
-        a_total += a_count
-        fb_total += fb_count
+    return _top_struggle_standards(standards, total_students, _falling_behind_names(standards))
+
+@cached_report
+def all_cohorts_pie_chart(teacher_id, context=None):
+    """Aggregate M/A/FB scores from most recent test for pie chart."""
 
-    total = m_total + a_total + fb_total
-    m_perc = (float(m_total) / float(total)) * 100
-    a_perc = (float(a_total) / float(total)) * 100
-    fb_perc = (float(fb_total) / float(total)) * 100
+    if context is None:
+        context = ReportContext()
 
-    m_dict = {"score": "M", "value": m_perc}
-    a_dict = {"score": "A", "value": a_perc}
-    fb_dict = {"score": "FB", "value": fb_perc}
+    # Get the most recent tests of all the teacher's cohorts
+    most_recent_tests = context.latest_test_ids(teacher_id)
 
-    summed_scores.append(m_dict)
-    summed_scores.append(a_dict)
-    summed_scores.append(fb_dict)
+    # Count the scores on those tests in one query
+    counts = count_scores(test_ids=most_recent_tests).get(None, _empty_counts())
 
-    return summed_scores
+    return _pie_chart(counts)
 
-def all_cohorts_most_recent_comp_to_normscores(teacher_id):
+@cached_report
+def all_cohorts_most_recent_comp_to_normscores(teacher_id, context=None):
+
+    if context is None:
+        context = ReportContext()
 
     final_scores = []
 
     # Get most recent % of standards met by calling other function
-    summed_scores = (all_cohorts_pie_chart(teacher_id))[0]
+    summed_scores = (all_cohorts_pie_chart(teacher_id, context))[0]
     summed_reformatted = {"cohortName": "My Students", "value": ((summed_scores["value"])/100)}
     final_scores.append(summed_reformatted)
 
     # Get most recent test IDs for teacher's cohorts
-    cohorts = model.Cohort.query.filter_by(teacher_id=teacher_id).all()
-
-    most_recent_tests = get_most_recent_tests(cohorts)
+    most_recent_tests = context.latest_test_ids(teacher_id)
 
     # Get norm scores for those test IDs
     cohort_names = []
 
     for test_id in most_recent_tests:
-        normscores = model.NormScore.query.filter_by(test_id=test_id).all()
+        normscores = context.norms(test_id)
         for normscore in normscores:
             if normscore.cohort_name not in cohort_names:
                 cohort_names.append(normscore.cohort_name)
@@ -454,409 +1343,365 @@ def all_cohorts_most_recent_comp_to_normscores(teacher_id):
             if normscore.cohort_name == item:
                 final_dict["value"] += normscore.score
                 item_total += 1
-        final_dict["value"] = final_dict["value"] / float(item_total)
+        if item_total:
+            final_dict["value"] = final_dict["value"] / float(item_total)
         final_scores.append(final_dict)
 
     final_scores.sort(key=itemgetter("cohortName"))
 
     return final_scores
 
-def all_cohorts_data_by_test(teacher_id):
+@cached_report
+def all_cohorts_data_by_test(teacher_id, context=None):
     """Use teacher id to get all student scores by test and aggregate counts of
     M/A/FB by test."""
 
-    # Get all teacher cohorts
-    cohorts = model.Cohort.query.filter_by(teacher_id=teacher_id).all()
-
-    # Make list of all tests associated with teacher's cohorts
-    all_tests = []
+    if context is None:
+        context = ReportContext()
 
-    for cohort in cohorts:
+    # Get all teacher cohorts
+    cohort_ids = [cohort.id for cohort in context.cohorts(teacher_id)]
+    if not cohort_ids:
+        return _data_by_test([], {})
 
-        # Get all tests associated with that cohort id
-        tests = model.Test.query.filter_by(cohort_id=cohort.id).all()
-
-        for test in tests:
-            all_tests.append(test)
-
-    # Initialize empty response list and counters
-    resp_list = []
-    m_total = 0
-    a_total = 0
-    fb_total = 0
-
-    # Add total dict to response list
-    total_dict = {"name": "All Tests"}
-    resp_list.append(total_dict)
-
-    # Loop through tests
-    for test in all_tests:
-        resp_dict = {}
-
-        # Add test name to dict
-        resp_dict["name"] = test.name
-
-        # Get all scores associated with each test id
-        scores = model.Score.query.filter_by(test_id=test.id).all()
-
-        # Loop through scores and count values
-        m_count = 0
-        a_count = 0
-        fb_count = 0
-        for score in scores:
-            if score.score == 'M':
-                m_count +=1
-            elif score.score == 'A':
-                a_count +=1
-            elif score.score == 'FB':
-                fb_count += 1
-
-        # Increment totals
-        m_total += m_count
-        a_total += a_count
-        fb_total += fb_count
-
-        # Add counts to dict for that test
-        resp_dict["3"] = m_count
-        resp_dict["2"] = a_count
-        resp_dict["1"] = fb_count
-        resp_list.append(resp_dict)
+    # Get all tests associated with those cohorts, grouped by cohort
+    tests = model.Test.query.filter(model.Test.cohort_id.in_(cohort_ids)).\
+        order_by(model.Test.cohort_id, model.Test.id).all()
 
-    # Add total counts to total dict
-    total_dict["3"] = m_total
-    total_dict["2"] = a_total
-    total_dict["1"] = fb_total
+    # Count scores for every test in one query
+    counts = count_scores("test", cohort_ids=cohort_ids)
 
-    return resp_list
+    return _data_by_test(tests, counts)
 
-def all_cohorts_data_most_recent_by_standard(teacher_id):
+@cached_report
+def all_cohorts_data_most_recent_by_standard(teacher_id, context=None):
     """Break out filtered data by standard. Aggregate M/A/FB scores by standard
-    and return counts for each standard."""
-
-    scores_list = []
-
-    # Get teacher's classes and most recent tests
-    cohorts = model.Cohort.query.filter_by(teacher_id=teacher_id).all()
-    most_recent_tests = get_most_recent_tests(cohorts)
+    across the most recent tests and return counts for each standard."""
 
-    # Get all students in each class
-    student_ids = []
-    for cohort in cohorts:
-        students = cohort.studentcohorts
-        for student in students:
-            student_ids.append(student.student.id)
+    if context is None:
+        context = ReportContext()
 
-    # Get all standards tested on the most recent tests
-    standards_list = []
-    for test_id in most_recent_tests:
-        scores = model.Score.query.filter_by(test_id=test_id, student_id=student_ids[0]).all()
-        for score in scores:
-            standards_list.append(score.standard)
+    # Get the standards on the most recent tests of the teacher's classes
+    standards = context.summarize_standards(context.latest_test_ids(teacher_id))
 
-    # Loop through standards and add each to a dict
-    for standard in standards_list:
-        scores_by_standard = {}
-        scores_by_standard["name"] = standard.code
-        scores_by_standard["description"] = standard.description
-        scores_by_standard["id"] = standard.id
-
-        # Loop through tests and get scores, count num of each score
-        for test_id in most_recent_tests:
-            m_count = 0
-            a_count = 0
-            fb_count = 0
-            total_length = 0
-
-            scores = model.Score.query.filter_by(test_id=test_id, standard_id=standard.id).all()
-            for score in scores:
-                total_length += 1
-                if score.score == "M":
-                    m_count += 1
-                elif score.score == "A":
-                    a_count += 1
-                elif score.score == "FB":
-                    fb_count += 1
-
-        # Add score counts to dict, along with percentage of Ms to sort by
-        scores_by_standard["3"] = m_count
-        scores_by_standard["2"] = a_count
-        scores_by_standard["1"] = fb_count
-        scores_by_standard["percent"] = (m_count / float(30))
+    return _data_by_standard(standards)
 
-        scores_list.append(scores_by_standard)
-
-    # Sort list of dicts by percent of Ms
-    scores_list.sort(key=itemgetter("percent"))
-    scores_list.reverse()
-
-    # Remove percentage from each dict in the list
-    for dict in scores_list:
-        if 'percent' in dict:
-            del dict['percent']
-
-    return scores_list
-
-def all_cohorts_top_struggle_students(teacher_id):
+@cached_report
+def all_cohorts_top_struggle_students(teacher_id, context=None):
     """Identify the students who are struggling with the most standards and
     require the most additional help."""
 
-    scores_list = []
+    if context is None:
+        context = ReportContext()
 
     # Get teacher's cohorts
-    cohorts = model.Cohort.query.filter_by(teacher_id=teacher_id).all()
+    cohorts = context.cohorts(teacher_id)
 
     # Get students in those cohorts
     student_list = []
     for cohort in cohorts:
         students = cohort.studentcohorts
         for student in students:
-            student_list.append(student)
-
-    # Get each student's scores and sum up counts of each score
-    for student in student_list:
-        scores = model.Score.query.filter_by(student_id=student.student.id).all()
-        total_scores = len(scores)
-        m_count = 0
-        a_count = 0
-        fb_count = 0
-        for score in scores:
-            if score.score == "M":
-                m_count += 1
-            elif score.score == "A":
-                a_count += 1
-            elif score.score == "FB":
-                fb_count += 1
-
-        # Calculate total percentages of As and FBs
-        a_percent = (float(a_count) / float(total_scores)) * 100
-        fb_percent = (float(fb_count) / float(total_scores)) * 100
-
-        # Add student to dict with name, percent of As, FBs, and totals
-        scores_by_student = {}
-        scores_by_student["name"] = student.student.first_name + " " + student.student.last_name
-        scores_by_student["A"] = a_percent
-        scores_by_student["FB"] = fb_percent
-        scores_by_student["total"] = a_percent + fb_percent
-        scores_list.append(scores_by_student)
+            student_list.append((student.student_id, student.student.first_name + " " + student.student.last_name))
 
-    # Sort list of dicts by the total percentage of As plus FBs and reverse list
-    scores_list.sort(key=itemgetter("total"))
-    scores_list.reverse()
+    # Count every student's scores in one query
+    counts = count_scores("student", student_ids=[student_id for student_id, name in student_list])
 
-    return scores_list
+    return _top_struggle_students(student_list, counts)
 
-def all_single_cohort_data(teacher_id):
+@cached_report
+def all_single_cohort_data(teacher_id, context=None):
     """Run all single cohort functions and compile into one giant JSON to send
     back to Angular."""
 
-    all_cohort_data_by_cohort = {}
-
-    cohorts = model.Cohort.query.filter_by(teacher_id=teacher_id).all()
-
-    for cohort in cohorts:
-        cohort_list = []
-        temp_dict = {}
-        temp_dict["report1"] = single_cohort_top_struggle_standards(cohort.id)
-        cohort_list.append(temp_dict)
-        temp_dict = {}
-        temp_dict["report2"] = single_cohort_pie_chart(cohort.id)
-        cohort_list.append(temp_dict)
-        temp_dict = {}
-        temp_dict["report3"] = single_cohort_most_recent_comp_to_normscores(cohort.id)
-        cohort_list.append(temp_dict)
-        temp_dict = {}
-        temp_dict["report4"] = single_cohort_data_by_test(cohort.id)
-        cohort_list.append(temp_dict)
-        temp_dict = {}
-        temp_dict["report5"] = single_cohort_data_most_recent_by_standard(cohort.id)
-        cohort_list.append(temp_dict)
-        temp_dict = {}
-        temp_dict["report6"] = single_cohort_top_struggle_students(cohort.id)
-        cohort_list.append(temp_dict)
-        temp_dict = {}
-        temp_dict["report7"] = single_cohort_scores_by_student(cohort.id)
-        cohort_list.append(temp_dict)
-        temp_dict = {}
-        temp_dict["report8"] = single_cohort_data_most_recent_by_standard(cohort.id)
-        cohort_list.append(temp_dict)
-        cohort_data = {"dataValues": cohort_list, "cohortName": cohort.name}
-        all_cohort_data_by_cohort[cohort.id] = cohort_data
-
-    return all_cohort_data_by_cohort
-
-def all_single_student_data(teacher_id):
+    return dict(iter_single_cohort_data(teacher_id, context))
+
+def iter_single_cohort_data(teacher_id, context=None):
+    """Yield (cohort ID, reports) for all_single_cohort_data as each cohort is
+    finished."""
+
+    if context is None:
+        context = ReportContext()
+
+    cohorts = context.cohorts(teacher_id)
+    reports = fan_out(lambda cohort, context: _build_isolated("cohort %d" % cohort.id, single_cohort_reports,
+                                                              cohort, context), cohorts, context)
+
+    for cohort, cohort_data in izip(cohorts, reports):
+        yield cohort.id, cohort_data
+
+def single_cohort_reports(cohort, context=None):
+    """Run all single cohort functions for one cohort."""
+
+    if context is None:
+        context = ReportContext()
+
+    cohort_list = []
+    temp_dict = {}
+    temp_dict["report1"] = single_cohort_top_struggle_standards(cohort.id, context)
+    cohort_list.append(temp_dict)
+    temp_dict = {}
+    temp_dict["report2"] = single_cohort_pie_chart(cohort.id, context)
+    cohort_list.append(temp_dict)
+    temp_dict = {}
+    temp_dict["report3"] = single_cohort_most_recent_comp_to_normscores(cohort.id, context)
+    cohort_list.append(temp_dict)
+    temp_dict = {}
+    temp_dict["report4"] = single_cohort_data_by_test(cohort.id, context)
+    cohort_list.append(temp_dict)
+    temp_dict = {}
+    by_standard = single_cohort_data_most_recent_by_standard(cohort.id, context)
+    temp_dict["report5"] = by_standard
+    cohort_list.append(temp_dict)
+    temp_dict = {}
+    temp_dict["report6"] = single_cohort_top_struggle_students(cohort.id, context)
+    cohort_list.append(temp_dict)
+    temp_dict = {}
+    temp_dict["report7"] = single_cohort_scores_by_student(cohort.id, context)
+    cohort_list.append(temp_dict)
+    temp_dict = {}
+    temp_dict["report8"] = by_standard
+    cohort_list.append(temp_dict)
+    return {"dataValues": cohort_list, "cohortName": cohort.name}
+
+@cached_report
+def all_single_student_data(teacher_id, context=None):
     """Run all single student functions and compile into one giant JSON to send
     back to Angular."""
 
-    all_student_data_by_student = {}
+    return dict(iter_single_student_data(teacher_id, context))
+
+def iter_single_student_data(teacher_id, context=None):
+    """Yield (student ID, reports) for all_single_student_data as each student
+    is finished, once for a student in more than one of the classes."""
 
-    cohorts = model.Cohort.query.filter_by(teacher_id=teacher_id).all()
+    if context is None:
+        context = ReportContext()
 
+    cohorts = context.cohorts(teacher_id)
+
+    students = []
+    finished = set()
     for cohort in cohorts:
         for studentcohort in cohort.studentcohorts:
-            student = studentcohort.student
-            student_list = []
-            temp_dict = {}
-            temp_dict["report1"] = student_pie_chart(student.id)
-            student_list.append(temp_dict)
-            temp_dict = {}
-            temp_dict["report2"] = student_top_struggle_standards(student.id)
-            student_list.append(temp_dict)
-            temp_dict = {}
-            temp_dict["report3"] = student_most_recent_comp_to_normscores(student.id)
-            student_list.append(temp_dict)
-            temp_dict = {}
-            temp_dict["report4"] = student_data_by_test(student.id)
-            student_list.append(temp_dict)
-            temp_dict = {}
-            temp_dict["report5"] = student_improvement(student.id)
-            student_list.append(temp_dict)
-            temp_dict = {}
-            temp_dict["report6"] = student_falling_behind_score_count(student.id)
-            student_list.append(temp_dict)
-            full_name = student.first_name + " " + student.last_name
-            student_data = {"dataValues": student_list, "firstName": student.first_name, "fullName": full_name}
-            all_student_data_by_student[student.id] = student_data
-
-    return all_student_data_by_student
+            if studentcohort.student_id not in finished:
+                finished.add(studentcohort.student_id)
+                students.append(studentcohort.student)
+
+    # Look up every student's classes at once
+    context.load_student_cohorts([student.id for student in students])
+
+    reports = fan_out(lambda student, context: _build_isolated("student %d" % student.id, single_student_reports,
+                                                               student, context), students, context)
+
+    for student, student_data in izip(students, reports):
+        yield student.id, student_data
+
+def single_student_reports(student, context=None):
+    """Run all single student functions for one student."""
+
+    if context is None:
+        context = ReportContext()
+
+    student_list = []
+    temp_dict = {}
+    temp_dict["report1"] = student_pie_chart(student.id, context)
+    student_list.append(temp_dict)
+    temp_dict = {}
+    temp_dict["report2"] = student_top_struggle_standards(student.id, context)
+    student_list.append(temp_dict)
+    temp_dict = {}
+    temp_dict["report3"] = student_most_recent_comp_to_normscores(student.id, context)
+    student_list.append(temp_dict)
+    temp_dict = {}
+    temp_dict["report4"] = student_data_by_test(student.id, context)
+    student_list.append(temp_dict)
+    temp_dict = {}
+    temp_dict["report5"] = student_improvement(student.id, context)
+    student_list.append(temp_dict)
+    temp_dict = {}
+    temp_dict["report6"] = student_falling_behind_score_count(student.id, context)
+    student_list.append(temp_dict)
+    full_name = student.first_name + " " + student.last_name
+    return {"dataValues": student_list, "firstName": student.first_name, "fullName": full_name}
+
+@cached_report
+def get_dashboard(teacher_id, context=None):
+    """Build every report on the teacher's dashboard from one shared
+    ReportContext, to send back to Angular in a single response."""
+
+    return cache.collect(iter_dashboard(teacher_id, context))
+
+def iter_dashboard(teacher_id, context=None):
+    """Yield (name, report) for get_dashboard as each report is finished. The
+    single cohort and single student reports aren't included; they are
+    loaded one at a time with get_cohort_reports and get_student_reports as
+    the teacher drills down."""
+
+    if context is None:
+        context = ReportContext()
+
+    reports = [("cohorts", get_teacher_cohorts),
+               ("allCohortsTopFB", all_cohorts_top_struggle_standards),
+               ("allCohortsPie", all_cohorts_pie_chart),
+               ("allCohortsNorm", all_cohorts_most_recent_comp_to_normscores),
+               ("allCohortsData", all_cohorts_data_by_test),
+               ("allStandard", all_cohorts_data_most_recent_by_standard),
+               ("allCohortsStudents", all_cohorts_top_struggle_students)]
+
+    # Load the cohorts every report starts from before building them at once
+    context.cohorts(teacher_id)
+    built = fan_out(lambda report, context: _build_dashboard_report(teacher_id, report, context), reports, context)
+
+    for (name, report), data in izip(reports, built):
+        yield name, data
+
+def _build_dashboard_report(teacher_id, report, context):
+    """Build one (name, builder) report of the dashboard. A report that fails
+    is logged and sent as null, so the rest of the dashboard still loads."""
+
+    name, build = report
+    return _build_isolated(name, build, teacher_id, context)
+
+def _build_isolated(name, build, item, context):
+    """Return build(item, context), or log the failure, add name to
+    context.errors, and return None if it raises. Reports are streamed after
+    the response has started, so one that fails is sent as null instead of
+    cutting the response short."""
+
+    try:
+        return build(item, context)
+    except Exception:
+        log.exception("Report %s failed", name)
+        context.errors.append(name)
+        return None
+
+def stream_report(teacher_id, report, build_items):
+    """Return an iterator over the items of one of the teacher's cached dict
+    reports, such as get_dashboard, from report_cache if it has the current
+    version, or from build_items(teacher_id, context) as they are built."""
+
+    context = ReportContext()
+    version = get_data_version(teacher_id)
+    return report_cache.iter_or_build(teacher_id, version, report.__name__, lambda: build_items(teacher_id, context),
+                                      lambda: not context.errors)
+
+def get_cohort_reports(teacher_id, cohort_id):
+    """Return all single cohort reports for one of the teacher's cohorts, as in
+    all_single_cohort_data, or None if the teacher has no such cohort."""
+
+    cohort = model.Cohort.query.filter_by(id=cohort_id, teacher_id=teacher_id).first()
+    if cohort is None:
+        return None
+
+    version = get_data_version(teacher_id)
+    return report_cache.get_or_build(teacher_id, version, "single_cohort_reports:%d" % cohort.id,
+                                     lambda: single_cohort_reports(cohort))
+
+def get_student_reports(teacher_id, student_id):
+    """Return all single student reports for a student in one of the teacher's
+    cohorts, as in all_single_student_data, or None if there is no such
+    student."""
+
+    studentcohort = report_query(model.StudentCohort, LOAD_STUDENT).join(model.Cohort).\
+        filter(model.StudentCohort.student_id == student_id, model.Cohort.teacher_id == teacher_id).first()
+    if studentcohort is None:
+        return None
+
+    version = get_data_version(teacher_id)
+    return report_cache.get_or_build(teacher_id, version, "single_student_reports:%d" % studentcohort.student_id,
+                                     lambda: single_student_reports(studentcohort.student))
+
+def get_cohort_index(teacher_id, page, per_page):
+    """List one page of the teacher's cohorts by name."""
+
+    query = model.Cohort.query.filter_by(teacher_id=teacher_id).order_by(model.Cohort.name, model.Cohort.id)
+    return _paginate(query, page, per_page, lambda cohort: {"cohort_id": cohort.id, "name": cohort.name})
+
+def get_student_index(teacher_id, page, per_page):
+    """List one page of the students in the teacher's cohorts by last name."""
+
+    student_ids = model.session.query(model.StudentCohort.student_id).join(model.Cohort).\
+        filter(model.Cohort.teacher_id == teacher_id)
+    query = model.User.query.filter(model.User.id.in_(student_ids)).\
+        order_by(model.User.last_name, model.User.first_name, model.User.id)
+    return _paginate(query, page, per_page,
+                     lambda student: {"id": student.id, "name": student.first_name + " " + student.last_name})
+
+def _paginate(query, page, per_page, item):
+    """Return page number page (counting from 1) of query's results, made
+    into dicts by item, with the total number of results."""
+
+    rows = query.limit(per_page).offset((page - 1) * per_page).all()
+    return {"page": page, "per_page": per_page, "total": query.count(), "items": [item(row) for row in rows]}
 
 def get_most_recent_test(cohort_id):
 
     # Get most recent test for the cohort
-    test = model.Test.query.filter_by(cohort_id=cohort_id).order_by(model.Test.test_date.desc()).first()
-    return test
+    return get_latest_tests([cohort_id]).get(cohort_id)
 
 def get_students_in_class(cohort_id):
 
-    # Get all the students in that cohort
-    students = model.StudentCohort.query.filter_by(cohort_id=cohort_id).all()
+    # Get all the students in that cohort, along with their user rows
+    students = report_query(model.StudentCohort, LOAD_STUDENT).filter_by(cohort_id=cohort_id).\
+        order_by(model.StudentCohort.id).all()
     return students
 
-def single_cohort_top_struggle_standards(cohort_id):
+def single_cohort_top_struggle_standards(cohort_id, context=None):
 
     """Identify the top standards students in a cohort are struggling with
     and which students have not met those standards."""
 
-    scores_list = []
+    if context is None:
+        context = ReportContext()
+    cube = context.cube(cohort_id)
 
-    # Get most recent test for the cohort
-    test = get_most_recent_test(cohort_id)
-
-    # Get all the students in that cohort
-    students = get_students_in_class(cohort_id)
+    # Nothing to report until the cohort has taken a test
+    if cube.latest_test is None:
+        return []
 
-    # Get the standards students were tested on in most recent test
-    standards_list = []
-    scores = model.Score.query.filter_by(test_id=test.id, student_id=students[0].student.id).all()
-    for score in scores:
-        standards_list.append(score.standard)
+    # Get the standards on the most recent test for the cohort
+    standards = cube.summarize_standards(cube.latest_test.id)
 
-    # Go through standards and add metadata about each to dictionary
-    for standard in standards_list:
-        scores_by_standard = {}
-        scores_by_standard["name"] = standard.code
-        scores_by_standard["description"] = standard.description
-        scores_by_standard["id"] = standard.id
-        scores_by_standard["students"] = []
-        total_scores = len(students)
-
-        m_count = 0
-        a_count = 0
-        fb_count = 0
-
-        # Loop through scores and add up counts of each
-        scores = model.Score.query.filter_by(test_id=test.id, standard_id=standard.id).all()
-
-        for score in scores:
-            if score.score == "M":
-                m_count += 1
-            elif score.score == "A":
-                a_count += 1
-            elif score.score == "FB":
-                fb_count += 1
-                scores_by_standard["students"].append(score.student.first_name + " " + score.student.last_name)
+    return _top_struggle_standards(standards, len(cube.roster_ids), cube.names)
 
-        # Calculate percentage of Ms
-        m_percent = (float(m_count) / float(total_scores)) * 100
-        scores_by_standard["percent"] = m_percent
-        scores_list.append(scores_by_standard)
-        scores_by_standard["students"].sort()
+def single_cohort_pie_chart(cohort_id, context=None):
+    """Aggregate M/A/FB scores from most recent test for pie chart.
+    for single class."""
 
-    # Sort list of dicts by percent of Ms
-    scores_list.sort(key=itemgetter("percent"))
+    if context is None:
+        context = ReportContext()
+    cube = context.cube(cohort_id)
 
-    return scores_list
+    # Count the scores on the most recent test, if the cohort has taken one
+    counts = _empty_counts()
+    if cube.latest_test is not None:
+        counts = cube.count_test(cube.latest_test.id)
 
-def single_cohort_pie_chart(cohort_id):
-    """Aggregate M/A/FB scores from most recent test for pie chart.
-    for single class."""
+    return _pie_chart(counts)
 
-    # Create empty list to hold the score aggregation
-    summed_scores = []
+def single_cohort_most_recent_comp_to_normscores(cohort_id, context=None):
 
-    # Get most recent test for the cohort
-    test = get_most_recent_test(cohort_id)
-
-    m_total = 0
-    a_total = 0
-    fb_total = 0
-
-    # Get scores for most recent test
-    scores = model.Score.query.filter_by(test_id=test.id).all()
-
-    # Initialize counters at zero
-    m_count = 0
-    a_count = 0
-    fb_count = 0
-
-    # Loop through score objects and get score value, append to list
-    for score in scores:
-        if score.score == 'M':
-            m_count +=1
-        elif score.score == 'A':
-            a_count +=1
-        elif score.score == 'FB':
-            fb_count += 1
-
-    # Increment totals
-    m_total += m_count
-    a_total += a_count
-    fb_total += fb_count
-
-    # Calculate total and find percentages of each score
-    total = m_total + a_total + fb_total
-    m_perc = (float(m_total) / float(total)) * 100
-    a_perc = (float(a_total) / float(total)) * 100
-    fb_perc = (float(fb_total) / float(total)) * 100
-
-    # Add each percentage to dict
-    m_dict = {"score": "M", "value": m_perc}
-    a_dict = {"score": "A", "value": a_perc}
-    fb_dict = {"score": "FB", "value": fb_perc}
-
-    # Add dicts to response list
-    summed_scores.append(m_dict)
-    summed_scores.append(a_dict)
-    summed_scores.append(fb_dict)
-
-    return summed_scores
-
-def single_cohort_most_recent_comp_to_normscores(cohort_id):
+    if context is None:
+        context = ReportContext()
+    cube = context.cube(cohort_id)
 
     final_scores = []
 
     # Get most recent % of standards met by calling other function
-    summed_scores = (single_cohort_pie_chart(cohort_id))[0]
+    summed_scores = (single_cohort_pie_chart(cohort_id, context))[0]
     summed_reformatted = {"cohortName": "My Students", "value": ((summed_scores["value"])/100)}
     final_scores.append(summed_reformatted)
 
     # Get most recent test ID for cohort
-    test = get_most_recent_test(cohort_id)
+    test = cube.latest_test
 
     # Get norm scores for those test IDs
     cohort_names = []
 
-    normscores = model.NormScore.query.filter_by(test_id=test.id).all()
+    normscores = []
+    if test is not None:
+        normscores = context.norms(test.id)
     for normscore in normscores:
         if normscore.cohort_name not in cohort_names:
             cohort_names.append(normscore.cohort_name)
@@ -885,197 +1730,72 @@ def single_cohort_most_recent_comp_to_normscores(cohort_id):
 
     return final_scores
 
-def single_cohort_data_by_test(cohort_id):
+def single_cohort_data_by_test(cohort_id, context=None):
     """Use cohort id to get all student scores for that cohort by test and
     aggregate counts of M/A/FB by test."""
 
-    # Get tests for that cohort
-    tests = model.Test.query.filter_by(cohort_id=cohort_id).all()
-
-    # Initialize empty response list and set counters to zero
-    resp_list = []
-    m_total = 0
-    a_total = 0
-    fb_total = 0
-
-    # Add total dict to response list
-    total_dict = {"name": "All Tests"}
-    resp_list.append(total_dict)
-
-    # Loop through tests
-    for test in tests:
-        resp_dict = {}
-        resp_dict["name"] = test.name
-
-        # Get all scores associated with each test id
-        scores = model.Score.query.filter_by(test_id=test.id).all()
-
-        # Loop through scores and count up each score
-        m_count = 0
-        a_count = 0
-        fb_count = 0
-        for score in scores:
-            if score.score == 'M':
-                m_count +=1
-            elif score.score == 'A':
-                a_count +=1
-            elif score.score == 'FB':
-                fb_count += 1
-
-        # Increment totals
-        m_total += m_count
-        a_total += a_count
-        fb_total += fb_count
-
-        # Add counts to response dict
-        resp_dict["3"] = m_count
-        resp_dict["2"] = a_count
-        resp_dict["1"] = fb_count
-        resp_list.append(resp_dict)
+    if context is None:
+        context = ReportContext()
+    cube = context.cube(cohort_id)
 
-    # Add totals to total dict
-    total_dict["3"] = m_total
-    total_dict["2"] = a_total
-    total_dict["1"] = fb_total
+    return _data_by_test(cube.tests, cube.count_by_test())
 
-    return resp_list
-
-def single_cohort_data_most_recent_by_standard(cohort_id):
+def single_cohort_data_most_recent_by_standard(cohort_id, context=None):
     """Break out filtered data by standard. Aggregate M/A/FB scores by standard
-    and return counts and percentages for each standard."""
-
-    scores_list = []
-
-    # Get most recent test
-    test = get_most_recent_test(cohort_id)
-
-    # Get students in class
-    students = get_students_in_class(cohort_id)
-
-    # Get standards from test and add to list
-    standards_list = []
-    scores = model.Score.query.filter_by(test_id=test.id, student_id=students[0].student.id).all()
-    for score in scores:
-        standards_list.append(score.standard)
-
-    # Loop through standards
-    for standard in standards_list:
-
-        # Add standard metadata to dict
-        scores_by_standard = {}
-        scores_by_standard["name"] = standard.code
-        scores_by_standard["description"] = standard.description
-        scores_by_standard["id"] = standard.id
-
-        # Initialize counters at zero
-        m_count = 0
-        a_count = 0
-        fb_count = 0
-
-        # Get scores and loop through, counting up each score
-        scores = model.Score.query.filter_by(test_id=test.id, standard_id=standard.id).all()
-        for score in scores:
-            if score.score == "M":
-                m_count += 1
-            elif score.score == "A":
-                a_count += 1
-            elif score.score == "FB":
-                fb_count += 1
-
-        # Add counts to dict and calculate percentage of Ms, add dict to list
-        scores_by_standard["3"] = m_count
-        scores_by_standard["2"] = a_count
-        scores_by_standard["1"] = fb_count
-        scores_by_standard["percent"] = (m_count / float(30))
-        scores_list.append(scores_by_standard)
+    and return counts for each standard."""
 
-    # Sort list of dicts by percentage of Ms and reverse it
-    scores_list.sort(key=itemgetter("percent"))
-    scores_list.reverse()
+    if context is None:
+        context = ReportContext()
+    cube = context.cube(cohort_id)
 
-    # Remove percentage of Ms from each dict
-    for dict in scores_list:
-        if "percent" in dict:
-            del dict["percent"]
+    # Nothing to report until the cohort has taken a test
+    if cube.latest_test is None:
+        return []
 
-    return scores_list
+    # Get the standards on the most recent test
+    return _data_by_standard(cube.summarize_standards(cube.latest_test.id))
 
-def single_cohort_top_struggle_students(cohort_id):
+def single_cohort_top_struggle_students(cohort_id, context=None):
     """Identify the students who are struggling with the most standards and
     require the most additional help."""
 
-    scores_list = []
+    if context is None:
+        context = ReportContext()
 
-    # Get all students in class
-    students = get_students_in_class(cohort_id)
+    # Get all students in class, and their counts across the class's tests
+    students = [(studentcohort.student_id, _full_name(studentcohort.student)) for studentcohort in context.roster(cohort_id)]
 
-    # Loop through students and get scores
-    for student in students:
-        scores = model.Score.query.filter_by(student_id=student.student.id).all()
-        total_scores = len(scores)
-
-        # Loop through scores and add up counts of each score
-        m_count = 0
-        a_count = 0
-        fb_count = 0
-        for score in scores:
-            if score.score == "M":
-                m_count += 1
-            elif score.score == "A":
-                a_count += 1
-            elif score.score == "FB":
-                fb_count += 1
-
-        # Calculate percentages of As and FBs
-        a_percent = (float(a_count) / float(total_scores)) * 100
-        fb_percent = (float(fb_count) / float(total_scores)) * 100
+    return _top_struggle_students(students, _count_by_student(cohort_id, context))
 
-        # Add scores to dict, add dict to response list
-        scores_by_student = {}
-        scores_by_student["name"] = student.student.first_name + " " + student.student.last_name
-        scores_by_student["A"] = a_percent
-        scores_by_student["FB"] = fb_percent
-        scores_by_student["total"] = a_percent + fb_percent
-        scores_list.append(scores_by_student)
+def _count_by_student(cohort_id, context):
+    """Return {student ID: {score value: count}} across the cohort's tests."""
 
-    # Sort and reverse list of dicts by total percentage of As and FBs
-    scores_list.sort(key=itemgetter("total"))
-    scores_list.reverse()
-
-    return scores_list
+    counts = {}
+    for (student_id, test_id), test_counts in context.student_counts(cohort_id).items():
+        counts[student_id] = _add_counts([counts.get(student_id, _empty_counts()), test_counts])
+    return counts
 
-def single_cohort_scores_by_student(cohort_id):
-
-    # Get students in class
-    students = get_students_in_class(cohort_id)
-
-    student_scores_list = []
+def _full_name(student):
+    return student.first_name + " " + student.last_name
 
-    for student in students:
+def single_cohort_scores_by_student(cohort_id, context=None):
 
-        student_score_dict = {}
+    if context is None:
+        context = ReportContext()
 
-        # Get student scores
-        scores = model.Score.query.filter_by(student_id=student.student.id).all()
+    # Count every student's scores across the cohort's tests
+    counts = _count_by_student(cohort_id, context)
 
-        m_count = 0
-        a_count = 0
-        fb_count = 0
+    student_scores_list = []
 
-        # Loop through scores and sum up counts of each
-        for score in scores:
-            if score.score == "M":
-                m_count += 1
-            elif score.score == "A":
-                a_count += 1
-            elif score.score == "FB":
-                fb_count += 1
+    for studentcohort in context.roster(cohort_id):
+        student_counts = counts.get(studentcohort.student_id, _empty_counts())
 
         # Add scores to dict, add dict to list
-        student_score_dict["studentName"] = student.student.first_name + " " + student.student.last_name
-        student_score_dict["3"] = m_count
-        student_score_dict["2"] = a_count
-        student_score_dict["1"] = fb_count
+        student_score_dict = {}
+        student_score_dict["studentName"] = _full_name(studentcohort.student)
+        for value in model.SCORE_LABELS:
+            student_score_dict[str(value)] = student_counts[value]
         student_scores_list.append(student_score_dict)
 
     # Sort list of dicts by student name
@@ -1306,111 +2026,91 @@ def single_cohort_scores_by_student(cohort_id):
 
 #     return {"count": fb_count}
 
-def student_pie_chart(student_id):
+def student_pie_chart(student_id, context=None):
     """Aggregate M/A/FB scores from most recent test for pie chart.
     for single student."""
 
-    # Create empty list to hold the score aggregation
-    summed_scores = []
-
-    # Get student cohort ID
-    cohort_id = (model.StudentCohort.query.filter_by(student_id=student_id).first()).cohort_id
-
-    # Get most recent test for the cohort
-    test = model.Test.query.filter_by(cohort_id=cohort_id).order_by(model.Test.test_date.desc()).first()
-
-    m_total = 0
-    a_total = 0
-    fb_total = 0
-
-    # Get scores for most recent test
-    scores = model.Score.query.filter_by(test_id=test.id, student_id=student_id).all()
+    if context is None:
+        context = ReportContext()
 
-    # Initialize counters at zero
-    m_count = 0
-    a_count = 0
-    fb_count = 0
+    # Get the student's class and its most recent test
+    cohort_id = context.student_cohort_ids(student_id)[0]
+    test = context.latest_test(cohort_id)
 
-    # Loop through score objects and get score value, append to list
-    for score in scores:
-        if score.score == 'M':
-            m_count +=1
-        elif score.score == 'A':
-            a_count +=1
-        elif score.score == 'FB':
-            fb_count += 1
+    # Count the student's scores on that test, if the class has taken one
+    counts = _empty_counts()
+    if test is not None:
+        counts = context.student_counts(cohort_id).get((student_id, test.id), counts)
 
-    m_total += m_count
-    a_total += a_count
-    fb_total += fb_count
+    return _pie_chart(counts)
 
-    total = m_total + a_total + fb_total
-    m_perc = (float(m_total) / float(total)) * 100
-    a_perc = (float(a_total) / float(total)) * 100
-    fb_perc = (float(fb_total) / float(total)) * 100
-
-    m_dict = {"score": "M", "value": m_perc}
-    a_dict = {"score": "A", "value": a_perc}
-    fb_dict = {"score": "FB", "value": fb_perc}
-
-    summed_scores.append(m_dict)
-    summed_scores.append(a_dict)
-    summed_scores.append(fb_dict)
-
-    return summed_scores
-
-def student_top_struggle_standards(student_id):
+def student_top_struggle_standards(student_id, context=None):
 
     """Identify the top standards students are struggling with."""
 
+    if context is None:
+        context = ReportContext()
+
     scores_list = []
 
     # Get most recent test for the cohort
-    cohort_id = (model.StudentCohort.query.filter_by(student_id=student_id).first()).cohort_id
-    test = model.Test.query.filter_by(cohort_id=cohort_id).order_by(model.Test.test_date.desc()).first()
-
-    # Get student scores for most recent test
-    scores = model.Score.query.filter_by(test_id=test.id, student_id=student_id).all()
-
-    for score in scores:
-        if score.score == "A" or score.score == "FB":
-            score_dict = {}
-            score_dict["name"] = score.standard.code
-            score_dict["description"] = score.standard.description
-            score_dict["score"] = score.score
-            scores_list.append(score_dict)
+    test = context.latest_test(context.student_cohort_ids(student_id)[0])
+    if test is None:
+        return scores_list
+
+    # Get the student's A and FB scores on the most recent test, in the order
+    # the test file listed the standards
+    scores = model.session.query(model.Score.score, model.Standard.code, model.Standard.description).\
+        join(model.Standard, model.Standard.id == model.Score.standard_id).\
+        filter(model.Score.test_id == test.id, model.Score.student_id == student_id,
+               model.Score.score.in_([model.ALMOST, model.FALLING_BEHIND])).\
+        order_by(model.Score.id)
+
+    for score, code, description in scores:
+        score_dict = {}
+        score_dict["name"] = code
+        score_dict["description"] = description
+        score_dict["score"] = model.SCORE_LABELS[score]
+        scores_list.append(score_dict)
 
     scores_list.sort(key=itemgetter("score"))
     scores_list.reverse()
 
     return scores_list
 
-def student_most_recent_comp_to_normscores(student_id):
+def student_most_recent_comp_to_normscores(student_id, context=None):
+
+    if context is None:
+        context = ReportContext()
 
     final_scores = []
 
-    # Get student name
-    student = model.User.query.filter_by(id=student_id).first()
-    student_name = student.first_name + " " + student.last_name
+    # Get the student's class and its most recent test
+    cohort_id = context.student_cohort_ids(student_id)[0]
+    test = context.latest_test(cohort_id)
 
     # Get most recent % of standards met for student
-    summed_scores = (student_pie_chart(student_id))[0]
-    summed_reformatted = {"cohortName": student_name, "value": ((summed_scores["value"])/100)}
+    summed_scores = (student_pie_chart(student_id, context))[0]
+    student = [studentcohort.student for studentcohort in context.roster(cohort_id)
+               if studentcohort.student_id == student_id][0]
+    summed_reformatted = {"cohortName": _full_name(student), "value": ((summed_scores["value"])/100)}
     final_scores.append(summed_reformatted)
 
     # Get most recent % of standards met for class overall
-    cohort_id = (model.StudentCohort.query.filter_by(student_id=student_id).first()).cohort_id
-    summed_scores = (single_cohort_pie_chart(cohort_id))[0]
+    class_counts = []
+    if test is not None:
+        class_counts = [counts for (other_id, test_id), counts in context.student_counts(cohort_id).items()
+                        if test_id == test.id]
+    summed_scores = _pie_chart(_add_counts(class_counts))[0]
     summed_reformatted = {"cohortName": "My Students", "value": ((summed_scores["value"])/100)}
     final_scores.append(summed_reformatted)
 
-    # Get most recent test ID for cohort
-    test = model.Test.query.filter_by(cohort_id=cohort_id).order_by(model.Test.test_date.desc()).first()
-
     # Get norm scores for those test IDs
     cohort_names = []
 
-    normscores = model.NormScore.query.filter_by(test_id=test.id).all()
+    normscores = []
+    if test is not None:
+        normscores = context.norms(test.id)
     for normscore in normscores:
         if normscore.cohort_name not in cohort_names:
             cohort_names.append(normscore.cohort_name)
@@ -1430,57 +2130,33 @@ def student_most_recent_comp_to_normscores(student_id):
 
     return final_scores
 
-def student_data_by_test(student_id):
-
-    cohorts = model.StudentCohort.query.filter_by(student_id=student_id).all()
-
-    scores_list = []
-
-    total_dict = {"name": "All Tests"}
-    scores_list.append(total_dict)
-    m_total = 0
-    a_total = 0
-    fb_total = 0
+def student_data_by_test(student_id, context=None):
 
-    for cohort in cohorts:
+    if context is None:
+        context = ReportContext()
 
-        tests = model.Test.query.filter_by(cohort_id=cohort.cohort_id).all()
-        for test in tests:
-            scores_dict = {}
-            scores_dict["name"] = test.name
-            scores = model.Score.query.filter_by(test_id=test.id, student_id=student_id).all()
-
-            m_count = 0
-            a_count = 0
-            fb_count = 0
-            for score in scores:
-                if score.score == 'M':
-                    m_count +=1
-                elif score.score == 'A':
-                    a_count +=1
-                elif score.score == 'FB':
-                    fb_count += 1
-
-            m_total += m_count
-            a_total += a_count
-            fb_total += fb_count
-            scores_dict["3"] = m_count
-            scores_dict["2"] = a_count
-            scores_dict["1"] = fb_count
-            scores_list.append(scores_dict)
-
-    total_dict["3"] = m_total
-    total_dict["2"] = a_total
-    total_dict["1"] = fb_total
+    # Get the tests of each of the student's cohorts, in the order the
+    # student joined them, with the student's counts on each
+    tests = []
+    counts = {}
+    for cohort_id in context.student_cohort_ids(student_id):
+        student_counts = context.student_counts(cohort_id)
+        for test in context.tests(cohort_id):
+            tests.append(test)
+            counts[test.id] = student_counts.get((student_id, test.id), _empty_counts())
 
-    return scores_list
+    return _data_by_test(tests, counts)
 
-def student_improvement(student_id):
+def student_improvement(student_id, context=None):
 
     """Get student scores for all tests and compare # of standards met
     from most recent test to prior test."""
 
-    student_scores = student_data_by_test(student_id)
+    student_scores = student_data_by_test(student_id, context)
+
+    # The first row is the "All Tests" total, so two tests need three rows
+    if len(student_scores) < 3:
+        return {"message": "scores will be compared once two tests have been uploaded."}
 
     most_recent_test = student_scores[-1]
     one_prior_test = student_scores[-2]
@@ -1497,11 +2173,11 @@ def student_improvement(student_id):
 
     return {"message": response}
 
-def student_falling_behind_score_count(student_id):
+def student_falling_behind_score_count(student_id, context=None):
 
     """Get the number of standards the student is falling behind on."""
 
-    student_scores = student_data_by_test(student_id)
+    student_scores = student_data_by_test(student_id, context)
 
     fb_count = student_scores[-1]["1"]
 
@@ -1,11 +1,20 @@
-from flask import Flask, make_response, send_file, session, request, redirect
+from flask import Flask, Response, make_response, send_file, session, request, redirect, stream_with_context
 import api
+import jobs
 import json
 import os
+import types
+import uuid
+import zlib
+from functools import wraps
+from itertools import chain, islice
 from werkzeug import secure_filename
 
 UPLOAD_FOLDER = "./static/uploads/"
 ALLOWED_EXTENSIONS = set(['csv'])
+STREAM_BUFFER_SIZE = 16 * 1024
+INDEX_PAGE_SIZE = 50
+MAX_INDEX_PAGE_SIZE = 200
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = '24KJSF98325KJLSDF972saf29832LFjasf87FZKFJL78f7ds98FSDKLF'
@@ -25,13 +34,30 @@ def upload_file():
         csvfile = request.files['csvfile']
         if csvfile and allowed_file(csvfile.filename):
             filename = secure_filename(csvfile.filename)
-            file_path = app.config['UPLOAD_FOLDER'] + filename
-            csvfile.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            file_path = _save_upload(csvfile)
     test_name = request.form.get("test_name")
     test_date = request.form.get("test_date")
     cohort_id = request.form["cohort"]
-    api.parse_CSV(file_path, test_name, test_date, cohort_id)
-    return redirect("/#/reports/")
+    teacher_id = session['user']
+    job_id = jobs.submit_file("Upload " + filename, teacher_id, file_path, api.parse_CSV, test_name, test_date, cohort_id)
+    return _job_response(job_id)
+
+@app.route("/uploadbatch/", methods=['GET', 'POST'])
+def upload_batch_file():
+    batchfile = request.files.get('batchfile')
+    if request.method != 'POST' or not batchfile or not batchfile.filename.lower().endswith(".zip"):
+        response = _convert_to_JSON(api.clarity_error("Choose a .zip file of test CSVs to upload."))
+        response.status_code = 400
+        return response
+
+    filename = secure_filename(batchfile.filename)
+    file_path = _save_upload(batchfile)
+    test_date = request.form.get("test_date")
+    cohort_id = request.form.get("cohort")
+    teacher_id = session['user']
+    job_id = jobs.submit_file("Upload " + filename, teacher_id, file_path, api.import_test_batch,
+                              teacher_id, cohort_id, test_date)
+    return _job_response(job_id)
 
 @app.route("/upload2/", methods=['GET', 'POST'])
 def upload_class_file():
@@ -39,15 +65,32 @@ def upload_class_file():
         csvfile = request.files['studentfile']
         if csvfile and allowed_file(csvfile.filename):
             filename = secure_filename(csvfile.filename)
-            file_path = app.config['UPLOAD_FOLDER'] + filename
-            csvfile.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            file_path = _save_upload(csvfile)
     class_name = request.form.get("class_name")
     teacher_id = session['user']
     cohort_id = api.add_new_cohort(class_name, teacher_id)
     user_type = "student"
-    api.create_student_from_csv(file_path, cohort_id, user_type)
+    job_id = jobs.submit_file("Upload " + filename, teacher_id, file_path, api.create_student_from_csv, cohort_id, user_type)
+    return _job_response(job_id)
+
+def _save_upload(upload):
+    """Save an uploaded file under a name of its own, so another upload with
+    the same name can't replace it before its job reads it. Return its path."""
 
-    return redirect("/#/reports/")
+    filename = uuid.uuid4().hex + "_" + secure_filename(upload.filename)
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    upload.save(file_path)
+    return file_path
+
+def _job_response(job_id):
+    """Answer an upload with the ID of its background job: as JSON for API
+    clients, or by redirecting a browser form back to the reports page."""
+
+    if request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'application/json':
+        response = _convert_to_JSON({"job_id": job_id})
+        response.status_code = 202
+        return response
+    return redirect("/#/reports/?job=" + job_id)
 
 @app.route("/getsamplefile/")
 def download_file():
@@ -61,6 +104,107 @@ def _convert_to_JSON(result):
     response.mimetype = "application/json"
     return response
 
+def _stream_JSON(items, depth=1):
+    """Stream (key, value) items as a JSON object web response, compressed
+    with gzip or deflate if the browser accepts either. The body is encoded
+    and sent as the items are built, so the first bytes go out before the last
+    item is finished and the JSON text is never held whole; the report itself
+    still is, by ReportCache, to cache it. Values that are generators of
+    items, and dicts less than depth levels down, are streamed the same way.
+
+    The first item is built before the response starts, so a report that
+    can't be started at all fails with an error status instead of a cut-off
+    body."""
+
+    items = iter(items)
+    first = list(islice(items, 1))
+
+    encoding = request.accept_encodings.best_match(["gzip", "deflate"])
+    chunks = _buffer(_iter_JSON(chain(first, items), depth))
+    if encoding:
+        chunks = _compress(chunks, encoding)
+
+    response = Response(stream_with_context(chunks), mimetype="application/json")
+    response.headers['Access-Control-Allow-Origin'] = "*"
+    response.headers['Vary'] = "Accept-Encoding"
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def _iter_JSON(items, depth):
+    """Encode items as a JSON object a piece at a time."""
+
+    yield "{"
+    for i, (key, value) in enumerate(items):
+        if i:
+            yield ", "
+        if not isinstance(key, basestring):
+            key = str(key)
+        yield json.dumps(key) + ": "
+
+        if isinstance(value, types.GeneratorType):
+            for chunk in _iter_JSON(value, depth - 1):
+                yield chunk
+        elif isinstance(value, dict) and depth > 1:
+            for chunk in _iter_JSON(value.iteritems(), depth - 1):
+                yield chunk
+        else:
+            yield json.dumps(value)
+    yield "}"
+
+def _buffer(chunks):
+    """Join small chunks into pieces of about STREAM_BUFFER_SIZE bytes."""
+
+    pieces = []
+    size = 0
+    for chunk in chunks:
+        pieces.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_BUFFER_SIZE:
+            yield "".join(pieces)
+            pieces = []
+            size = 0
+    if pieces:
+        yield "".join(pieces)
+
+def _compress(chunks, encoding):
+    """Compress chunks with gzip or deflate as they come."""
+
+    if encoding == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS)
+
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def _conditional_report(view):
+    """Tag a teacher's report with their data version as its ETag, and answer
+    304 Not Modified before running the report when the browser already has
+    that version. The version also changes when another teacher's upload or
+    roster touches students the teacher shares (see
+    api.bump_shared_data_versions), so student reports can't go stale."""
+
+    @wraps(view)
+    def conditional(*args, **kwargs):
+        teacher_id = session['user']
+        etag = "%s-%s" % (teacher_id, api.get_data_version(teacher_id))
+        if etag in request.if_none_match:
+            response = make_response("", 304)
+            response.headers['Access-Control-Allow-Origin'] = "*"
+        else:
+            response = view(*args, **kwargs)
+
+        # Let the browser keep the report, but check it's current before using it
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = "private, no-cache"
+        return response
+
+    return conditional
+
 @app.route("/api/addclass/", methods=['POST'])
 def addclass():
     class_info = json.loads(request.data)
@@ -68,68 +212,138 @@ def addclass():
     teacher_id = session['user']
     cohort_id = api.add_new_cohort(cohort_name, teacher_id)
     list_of_students = class_info.get("students")
+    students = []
     for student in list_of_students:
-        user_type = "student"
-        first_name = student.get("first_name")
-        last_name = student.get("last_name")
-        student_id = api.create_student(user_type, first_name, last_name)
-        api.add_student_to_cohort(student_id, cohort_id)
+        if student:
+            students.append((student.get("first_name"), student.get("last_name")))
+    api.add_roster_to_cohort(cohort_id, students, "student")
     return "Success"
 
+@app.route("/api/jobs/<job_id>/")
+def get_job_status(job_id):
+    teacher_id = session['user']
+    response = jobs.get_job(job_id, teacher_id)
+    if response is None:
+        response = _convert_to_JSON(api.clarity_error("Job does not exist."))
+        response.status_code = 404
+        return response
+    return _convert_to_JSON(response)
+
 @app.route("/api/getclasses/")
+@_conditional_report
 def get_cohorts():
     teacher_id = session['user']
     response = api.get_teacher_cohorts(teacher_id)
     return _convert_to_JSON(response)
 
 @app.route("/api/allcohortstopfb/")
+@_conditional_report
 def all_cohorts_top_struggle_standards():
     teacher_id = session['user']
     response = api.all_cohorts_top_struggle_standards(teacher_id)
     return _convert_to_JSON(response)
 
 @app.route("/api/allcohortspie/")
+@_conditional_report
 def all_cohorts_data_pie_chart():
     teacher_id = session['user']
     response = api.all_cohorts_pie_chart(teacher_id)
     return _convert_to_JSON(response)
 
 @app.route("/api/allcohortsnorm/")
+@_conditional_report
 def all_cohorts_comp_to_norm():
     teacher_id = session['user']
     response = api.all_cohorts_most_recent_comp_to_normscores(teacher_id)
     return _convert_to_JSON(response)
 
 @app.route("/api/allcohortscounts/")
+@_conditional_report
 def all_cohorts_data():
     teacher_id = session['user']
     response = api.all_cohorts_data_by_test(teacher_id)
     return _convert_to_JSON(response)
 
 @app.route("/api/allcohortsbystandard/")
+@_conditional_report
 def all_cohorts_by_standard():
     teacher_id = session['user']
     response = api.all_cohorts_data_most_recent_by_standard(teacher_id)
     return _convert_to_JSON(response)
 
 @app.route("/api/allcohortsstudents/")
+@_conditional_report
 def all_cohorts_top_struggle_students():
     teacher_id = session['user']
     response = api.all_cohorts_top_struggle_students(teacher_id)
     return _convert_to_JSON(response)
 
 @app.route("/api/allsinglecohortdata/")
+@_conditional_report
 def all_single_cohort_data_by_cohort():
     teacher_id = session['user']
-    response = api.all_single_cohort_data(teacher_id)
-    return _convert_to_JSON(response)
+    response = api.stream_report(teacher_id, api.all_single_cohort_data, api.iter_single_cohort_data)
+    return _stream_JSON(response)
 
 @app.route("/api/allsinglestudentdata/")
+@_conditional_report
 def all_single_student_data_by_student():
     teacher_id = session['user']
-    response = api.all_single_student_data(teacher_id)
+    response = api.stream_report(teacher_id, api.all_single_student_data, api.iter_single_student_data)
+    return _stream_JSON(response)
+
+@app.route("/api/dashboard/")
+@_conditional_report
+def dashboard():
+    teacher_id = session['user']
+    response = api.stream_report(teacher_id, api.get_dashboard, api.iter_dashboard)
+    return _stream_JSON(response)
+
+@app.route("/api/cohorts/")
+@_conditional_report
+def cohort_index():
+    teacher_id = session['user']
+    page, per_page = _page_args()
+    response = api.get_cohort_index(teacher_id, page, per_page)
     return _convert_to_JSON(response)
 
+@app.route("/api/students/")
+@_conditional_report
+def student_index():
+    teacher_id = session['user']
+    page, per_page = _page_args()
+    response = api.get_student_index(teacher_id, page, per_page)
+    return _convert_to_JSON(response)
+
+@app.route("/api/cohorts/<int:cohort_id>/reports/")
+@_conditional_report
+def cohort_reports(cohort_id):
+    teacher_id = session['user']
+    response = api.get_cohort_reports(teacher_id, cohort_id)
+    if response is None:
+        response = _convert_to_JSON(api.clarity_error("Class does not exist."))
+        response.status_code = 404
+        return response
+    return _convert_to_JSON(response)
+
+@app.route("/api/students/<int:student_id>/reports/")
+@_conditional_report
+def student_reports(student_id):
+    teacher_id = session['user']
+    response = api.get_student_reports(teacher_id, student_id)
+    if response is None:
+        response = _convert_to_JSON(api.clarity_error("Student does not exist."))
+        response.status_code = 404
+        return response
+    return _convert_to_JSON(response)
+
+def _page_args():
+    """Read the page and per_page query arguments of an index request."""
+
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = min(max(request.args.get("per_page", INDEX_PAGE_SIZE, type=int), 1), MAX_INDEX_PAGE_SIZE)
+    return page, per_page
+
 @app.route("/api/signup/", methods=['POST'])
 def add_user():
     new_user = json.loads(request.data)
@@ -0,0 +1,95 @@
+from cStringIO import StringIO
+from sqlalchemy import text
+
+
+"""Bulk Writes"""
+
+def is_postgres(session):
+    """Check whether the session is bound to a Postgres database."""
+
+    return session.bind.dialect.name == "postgresql"
+
+def _copy_value(value):
+    """Format one value for the text format used by Postgres COPY."""
+
+    if value is None:
+        return "\\N"
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    value = str(value)
+
+    # Escape the characters COPY treats as delimiters
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def copy_rows(session, table, columns, rows):
+    """Write rows (tuples ordered like columns) into table using Postgres COPY.
+    Runs on the session's connection, so the rows are part of the current
+    transaction. Return the number of rows written."""
+
+    # Build the COPY payload in memory
+    buf = StringIO()
+    count = 0
+    for row in rows:
+        buf.write("\t".join([_copy_value(value) for value in row]))
+        buf.write("\n")
+        count += 1
+
+    if count == 0:
+        return 0
+
+    # Hand the payload to the DBAPI cursor in a single COPY
+    buf.seek(0)
+    cursor = session.connection().connection.cursor()
+    cursor.copy_from(buf, table.name, columns=columns)
+    cursor.close()
+
+    return count
+
+def insert_rows(session, table, columns, rows):
+    """Write rows (tuples ordered like columns) into table with one
+    executemany INSERT. Return the number of rows written."""
+
+    params = [dict(zip(columns, row)) for row in rows]
+    if params:
+        session.execute(table.insert(), params)
+    return len(params)
+
+def write_rows(session, table, columns, rows):
+    """Write rows into table the fastest way the engine allows: COPY on
+    Postgres, an executemany INSERT elsewhere. Return the number of rows written."""
+
+    if is_postgres(session):
+        return copy_rows(session, table, columns, rows)
+    return insert_rows(session, table, columns, rows)
+
+def insert_returning(session, table, columns, rows):
+    """Insert rows (tuples ordered like columns) and return a list of
+    (id,) + row tuples for them. On Postgres this is a single multi-row
+    INSERT ... RETURNING; other engines insert one row at a time."""
+
+    rows = list(rows)
+    if not rows:
+        return []
+
+    # Build one VALUES list with a bind parameter per cell
+    if is_postgres(session):
+        values = []
+        params = {}
+        for i, row in enumerate(rows):
+            names = []
+            for column, value in zip(columns, row):
+                name = "%s_%d" % (column, i)
+                params[name] = value
+                names.append(":" + name)
+            values.append("(" + ", ".join(names) + ")")
+
+        statement = "INSERT INTO %s (%s) VALUES %s RETURNING id, %s" % (
+            table.name, ", ".join(columns), ", ".join(values), ", ".join(columns))
+        return [tuple(row) for row in session.execute(text(statement), params)]
+
+    # Otherwise insert each row and collect its new primary key
+    inserted = []
+    for row in rows:
+        result = session.execute(table.insert(), dict(zip(columns, row)))
+        inserted.append((result.inserted_primary_key[0],) + tuple(row))
+    return inserted
@@ -0,0 +1,128 @@
+import json
+import threading
+import types
+from collections import OrderedDict
+
+
+"""Report Cache"""
+
+class LRUCache(object):
+    """A thread-safe in-process cache that keeps the max_size most recently
+    used values."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value cached for key, or None."""
+
+        with self._lock:
+            if key not in self._values:
+                return None
+
+            # Move the value to the most recently used end
+            value = self._values.pop(key)
+            self._values[key] = value
+            return value
+
+    def set(self, key, value):
+        """Cache value for key, dropping the least recently used value if the
+        cache is full."""
+
+        with self._lock:
+            self._values.pop(key, None)
+            self._values[key] = value
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+class ReportCache(object):
+    """Built reports keyed by teacher, data version, and report name, in two
+    tiers: an in-process LRUCache in front of an optional shared tier. The
+    shared tier can be any object with get(key) and set(key, value) methods
+    on strings, such as a memcache client, so processes and servers can
+    share reports; values are stored there as JSON.
+
+    Keys include the teacher's data version, so when their data changes the
+    old reports simply stop being asked for and age out."""
+
+    def __init__(self, max_size, shared=None):
+        self.local = LRUCache(max_size)
+        self.shared = shared
+
+    def get(self, key):
+        """Return the report cached for key, or None."""
+
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            data = self.shared.get(key)
+            if data is not None:
+                value = json.loads(data)
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        """Cache a report in both tiers."""
+
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, json.dumps(value))
+
+    def get_or_build(self, teacher_id, version, report, build, cacheable=None):
+        """Return the teacher's report at the given data version, calling
+        build() to make it on a miss. If given, cacheable() is asked after the
+        build whether the report may be cached."""
+
+        key = "report:%s:%s:%s" % (teacher_id, version, report)
+        value = self.get(key)
+        if value is None:
+            value = build()
+            if cacheable is None or cacheable():
+                self.set(key, value)
+        return value
+
+    def iter_or_build(self, teacher_id, version, report, build_items, cacheable=None):
+        """Return an iterator over the (key, value) items of the teacher's dict
+        report at the given data version. On a miss the items come from
+        build_items() as they are built, and the finished report is cached
+        once they have all been read, if cacheable() allows it."""
+
+        key = "report:%s:%s:%s" % (teacher_id, version, report)
+        value = self.get(key)
+        if value is not None:
+            return value.iteritems()
+        return self._build_items(key, build_items(), cacheable)
+
+    def _build_items(self, key, items, cacheable):
+        value = {}
+        for item in _collect_items(items, value):
+            yield item
+        if cacheable is None or cacheable():
+            self.set(key, value)
+
+def collect(items):
+    """Build a dict report from (key, value) items. A value may itself be a
+    generator of items, which is collected into a dict too."""
+
+    report = {}
+    for key, value in items:
+        if isinstance(value, types.GeneratorType):
+            value = collect(value)
+        report[key] = value
+    return report
+
+def _collect_items(items, report):
+    """Pass items through, adding each to report as it goes, like collect."""
+
+    for key, value in items:
+        if isinstance(value, types.GeneratorType):
+            report[key] = {}
+            value = _collect_items(value, report[key])
+        else:
+            report[key] = value
+        yield key, value
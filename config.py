@@ -1,3 +1,18 @@
 import os
 
 DB_URI = os.environ.get('DATABASE_URL', 'postgresql://localhost/clarity')
+
+# Number of scores buffered before each write during test upload
+INGEST_CHUNK_SIZE = int(os.environ.get('INGEST_CHUNK_SIZE', 5000))
+
+# Number of background threads processing uploaded files
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 2))
+
+# Number of worker processes parsing files in a batch test import
+IMPORT_PROCESSES = int(os.environ.get('IMPORT_PROCESSES', 4))
+
+# Number of built reports each server process keeps in memory
+REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', 500))
+
+# Number of threads building reports at once in each server process
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 4))
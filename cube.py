@@ -0,0 +1,141 @@
+import model
+import numpy
+
+
+"""Score Cube"""
+
+class ScoreCube(object):
+    """One cohort's scores, loaded once into a dense tests x standards x
+    students int8 array of score values (0 where there is no score), with
+    vectors of the test, standard, and student IDs along each axis. The
+    single cohort reports are computed from it with array reductions instead
+    of further queries."""
+
+    def __init__(self, cohort_id):
+        self.cohort_id = cohort_id
+
+        # Tests in upload order, and the most recent one by date
+        self.tests = model.Test.query.filter_by(cohort_id=cohort_id).order_by(model.Test.id).all()
+        self.latest_test = None
+        if self.tests:
+            self.latest_test = max(self.tests, key=lambda test: (test.test_date, test.id))
+
+        # Students in the class, in the order they were added
+        self.roster_ids = [student_id for (student_id,) in model.session.query(model.StudentCohort.student_id).
+                           filter_by(cohort_id=cohort_id).order_by(model.StudentCohort.id)]
+
+        # Every score on the cohort's tests, in the order they were uploaded
+        rows = []
+        if self.tests:
+            rows = model.session.query(model.Score.test_id, model.Score.standard_id,
+                                       model.Score.student_id, model.Score.score).\
+                filter(model.Score.test_id.in_([test.id for test in self.tests])).\
+                order_by(model.Score.id).all()
+
+        # Index the axes: standards as they were first uploaded, students on
+        # the roster first, then anyone else scored on the cohort's tests
+        self.test_ids = numpy.array([test.id for test in self.tests], dtype=numpy.int64)
+        self.standard_ids = numpy.array(_unique([row[1] for row in rows]), dtype=numpy.int64)
+        self.student_ids = numpy.array(_unique(self.roster_ids + [row[2] for row in rows]), dtype=numpy.int64)
+        self._test_index = _index(self.test_ids)
+        self._standard_index = _index(self.standard_ids)
+
+        # Fill the cube
+        tests = numpy.array([self._test_index[row[0]] for row in rows], dtype=numpy.intp)
+        standards = numpy.array([self._standard_index[row[1]] for row in rows], dtype=numpy.intp)
+        self._student_index = _index(self.student_ids)
+        students = numpy.array([self._student_index[row[2]] for row in rows], dtype=numpy.intp)
+
+        self.values = numpy.zeros((len(self.test_ids), len(self.standard_ids), len(self.student_ids)), dtype=numpy.int8)
+        self.values[tests, standards, students] = [row[3] for row in rows]
+
+        # Remember where each standard first appears on each test, to list
+        # standards in the order the test file did
+        self._row_count = len(rows)
+        self._first_row = numpy.empty(self.values.shape[:2], dtype=numpy.intp)
+        self._first_row.fill(self._row_count)
+        numpy.minimum.at(self._first_row, (tests, standards), numpy.arange(len(rows)))
+
+        # Look up the standards and student names once
+        self.standards = {}
+        if len(self.standard_ids):
+            for standard_id, code, description in model.session.query(model.Standard.id, model.Standard.code,
+                                                                       model.Standard.description).\
+                    filter(model.Standard.id.in_(self.standard_ids.tolist())):
+                self.standards[standard_id] = (code, description)
+
+        self.names = {}
+        if len(self.student_ids):
+            for user_id, first_name, last_name in model.session.query(model.User.id, model.User.first_name,
+                                                                      model.User.last_name).\
+                    filter(model.User.id.in_(self.student_ids.tolist())):
+                self.names[user_id] = first_name + " " + last_name
+
+    def _counts(self, values, axis):
+        """Count each score value in values, reducing over axis. Return a list
+        of {score value: count}, one for each position left."""
+
+        totals = [(value, (values == value).sum(axis=axis)) for value in model.SCORE_LABELS]
+        return [dict((value, int(total[i])) for value, total in totals) for i in range(len(totals[0][1]))]
+
+    def count_test(self, test_id):
+        """Return {score value: count} for one test."""
+
+        values = self.values[self._test_index[test_id]]
+        return dict((value, int((values == value).sum())) for value in model.SCORE_LABELS)
+
+    def count_by_test(self):
+        """Return {test ID: {score value: count}}, like count_scores("test")."""
+
+        return dict(zip(self.test_ids.tolist(), self._counts(self.values, (1, 2))))
+
+    def count_by_student(self):
+        """Return {student ID: {score value: count}} across the cohort's tests."""
+
+        return dict(zip(self.student_ids.tolist(), self._counts(self.values, (0, 1))))
+
+    def _standard_order(self, t):
+        """Positions of the standards on the test at position t, in the order
+        the test file listed them."""
+
+        order = numpy.argsort(self._first_row[t], kind="mergesort")
+        return order[self._first_row[t][order] < self._row_count]
+
+    def summarize_standards(self, test_id):
+        """Return one dict per standard on a test, in the order the test file
+        listed them, shaped like api._summarize_standards."""
+
+        t = self._test_index[test_id]
+        values = self.values[t]
+        counts = self._counts(values, 1)
+        falling_behind = values == model.FALLING_BEHIND
+
+        standards = []
+        for s in self._standard_order(t).tolist():
+            standard_id = int(self.standard_ids[s])
+            code, description = self.standards[standard_id]
+            standards.append({
+                "id": standard_id,
+                "name": code,
+                "description": description,
+                "counts": counts[s],
+                "falling_behind_ids": self.student_ids[falling_behind[s]].tolist(),
+            })
+
+        return standards
+
+def _unique(ids):
+    """Drop repeated IDs, keeping the first of each."""
+
+    seen = set()
+    unique = []
+    for i in ids:
+        if i not in seen:
+            seen.add(i)
+            unique.append(i)
+    return unique
+
+def _index(ids):
+    """Map each ID in an axis vector to its position."""
+
+    return dict((i, position) for position, i in enumerate(ids.tolist()))
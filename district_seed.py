@@ -0,0 +1,140 @@
+"""Generate a synthetic district for load and performance testing: teachers,
+their classes and rosters, tests, and M/A/FB and norm scores for every
+student on every standard tested. Everything is written through the same
+bulk paths as real uploads. Run after standards_seed.py, for example:
+
+    python district_seed.py --teachers 200 --cohorts 5 --students 30 --tests 10
+"""
+
+import model
+import api
+import bulk
+import argparse
+import random
+import uuid
+from datetime import datetime, timedelta
+
+FIRST_NAMES = ["Ava", "Ben", "Carmen", "Dev", "Elena", "Femi", "Grace", "Hiro", "Isla", "Jamal",
+               "Kira", "Luis", "Maya", "Noah", "Omar", "Priya", "Quinn", "Rosa", "Sam", "Tariq",
+               "Uma", "Victor", "Wen", "Xavier", "Yara", "Zoe"]
+LAST_NAMES = ["Adams", "Brown", "Chen", "Diaz", "Evans", "Fischer", "Garcia", "Hughes", "Ito", "Jones",
+              "Khan", "Lopez", "Murphy", "Nguyen", "Okafor", "Patel", "Quist", "Rossi", "Smith", "Tran",
+              "Ueda", "Vargas", "Walsh", "Xu", "Young", "Zhang"]
+GRADES = ["3", "4", "5", "6", "7", "8"]
+NORMS = ["Synthetic School", "Synthetic District"]
+FIRST_TEST_DATE = datetime(2014, 9, 15)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a synthetic district of test data.")
+    parser.add_argument("--teachers", type=int, default=200, help="number of teachers")
+    parser.add_argument("--cohorts", type=int, default=5, help="classes per teacher")
+    parser.add_argument("--students", type=int, default=30, help="students per class")
+    parser.add_argument("--tests", type=int, default=10, help="tests per class")
+    parser.add_argument("--standards", type=int, default=40, help="standards per test")
+    parser.add_argument("--seed", type=int, default=None, help="random seed, for a repeatable district")
+    return parser.parse_args()
+
+def get_standards_by_grade(session):
+    """Group the standards catalog by grade, as "CODE description" cells like
+    the first column of an uploaded test file."""
+
+    standards_by_grade = {}
+    for code, description in session.query(model.Standard.code, model.Standard.description).order_by(model.Standard.id):
+        parts = code.split(".")
+        if len(parts) > 1 and parts[1] in GRADES:
+            standards_by_grade.setdefault(parts[1], []).append(code + " " + description)
+
+    return standards_by_grade
+
+def generate_test_rows(rng, standards, abilities):
+    """Yield (standard, scores, norm_scores) rows for one test. Each student's
+    chance of meeting a standard depends on their ability and the standard's
+    difficulty, so reports show realistic spreads."""
+
+    for standard in standards:
+        difficulty = rng.uniform(-0.3, 0.3)
+        scores = []
+        met = 0
+        for ability in abilities:
+            roll = rng.random() + ability - difficulty
+            if roll > 0.65:
+                scores.append("M")
+                met += 1
+            elif roll > 0.3:
+                scores.append("A")
+            else:
+                scores.append("FB")
+
+        # Norm groups score near the class, a little better the wider they get
+        class_rate = met / float(len(abilities))
+        norm_scores = [round(min(1.0, class_rate + rng.uniform(0, 0.1) * (i + 1)), 4) for i in range(len(NORMS))]
+
+        yield standard, scores, norm_scores
+
+def generate_district(session, teachers, cohorts, students, tests, standards_per_test, seed=None):
+    """Generate the district and load it through the bulk write paths."""
+
+    rng = random.Random(seed)
+
+    # Tag names and emails with a run ID so repeated runs don't collide
+    run_id = uuid.UUID(int=rng.getrandbits(128)).hex[:6]
+
+    standards_by_grade = get_standards_by_grade(session)
+    if not standards_by_grade:
+        raise ValueError("The standards table is empty; run standards_seed.py first.")
+
+    use_copy = bulk.is_postgres(session)
+    student_number = 0
+
+    # Add all the teachers at once
+    teacher_rows = [("teacher", "teacher-%s-%d@example.org" % (run_id, t), "password",
+                     rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)) for t in range(teachers)]
+    teacher_ids = [row[0] for row in bulk.insert_returning(
+        session, model.User.__table__, ("user_type", "email", "password", "first_name", "last_name"), teacher_rows)]
+    session.commit()
+
+    for t, teacher_id in enumerate(teacher_ids):
+        grade = rng.choice(GRADES)
+        grade_standards = standards_by_grade.get(grade) or rng.choice(standards_by_grade.values())
+
+        # Add the teacher's classes at once
+        cohort_rows = [("Grade %s Section %d" % (grade, c + 1), teacher_id) for c in range(cohorts)]
+        cohort_ids = [row[0] for row in bulk.insert_returning(
+            session, model.Cohort.__table__, ("name", "teacher_id"), cohort_rows)]
+        session.commit()
+
+        for cohort_id in cohort_ids:
+            new_standards = {}
+
+            # Enroll a roster of uniquely named students
+            roster = []
+            for s in range(students):
+                student_number += 1
+                roster.append((rng.choice(FIRST_NAMES), "%s-%s-%d" % (rng.choice(LAST_NAMES), run_id, student_number)))
+            student_ids = api.add_roster_to_cohort(cohort_id, roster)
+            abilities = [rng.uniform(-0.25, 0.25) for student_id in student_ids]
+
+            # Give the class its tests, improving a little over the year
+            for n in range(tests):
+                test = model.Test(name="Grade %s Interim #%d" % (grade, n + 1),
+                                  test_date=FIRST_TEST_DATE + timedelta(days=21 * n),
+                                  cohort_id=cohort_id)
+                session.add(test)
+                session.flush()
+
+                standards = rng.sample(grade_standards, min(standards_per_test, len(grade_standards)))
+                growth = [ability + 0.02 * n for ability in abilities]
+                api.load_test_rows(test.id, student_ids, NORMS, generate_test_rows(rng, standards, growth), use_copy,
+                                   new_standards=new_standards)
+
+            session.commit()
+            api.publish_standards(new_standards)
+
+        print("Teacher %d of %d loaded" % (t + 1, teachers))
+
+def main(session):
+    args = parse_args()
+    generate_district(session, args.teachers, args.cohorts, args.students, args.tests, args.standards, args.seed)
+
+if __name__ == "__main__":
+    main(model.session)
@@ -0,0 +1,133 @@
+import config
+import model
+import os
+import threading
+import time
+import uuid
+from multiprocessing.pool import ThreadPool
+
+
+"""Background Jobs"""
+
+# Finished jobs are forgotten after this many seconds
+JOB_EXPIRY = 60 * 60
+
+_pool = None
+_jobs = {}
+_lock = threading.Lock()
+
+class Job(object):
+    """A unit of work run on the background pool, with its progress and result."""
+
+    def __init__(self, name, owner_id, file_path=None):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.owner_id = owner_id
+        self.file_path = file_path
+        self.status = "queued"
+        self.rows_processed = 0
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+
+    def progress(self, rows_processed):
+        """Record how many rows the job has processed so far."""
+
+        self.rows_processed = rows_processed
+
+    def to_dict(self):
+        """Return the job's status as a dictionary to send back as JSON."""
+
+        rows_per_second = 0
+        if self.started:
+            elapsed = (self.finished or time.time()) - self.started
+            if elapsed > 0:
+                rows_per_second = self.rows_processed / elapsed
+
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "rows_processed": self.rows_processed,
+            "rows_per_second": rows_per_second,
+            "result": self.result,
+            "error": self.error,
+        }
+
+def _get_pool():
+    """Start the worker pool on first use, so importing this module is free."""
+
+    global _pool
+
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPool(config.UPLOAD_WORKERS)
+    return _pool
+
+def _run(job, func, args, kwargs):
+    """Run a job's function on a worker thread, passing it the job's progress
+    callback, and record the result or error."""
+
+    job.status = "running"
+    job.started = time.time()
+    try:
+        job.result = func(*args, progress=job.progress, **kwargs)
+        status = "done"
+    except Exception as e:
+        job.error = str(e)
+        status = "failed"
+    finally:
+        job.finished = time.time()
+
+        # Each worker thread has its own scoped session; release it
+        model.session.remove()
+
+        # The uploaded file isn't needed once the job is done with it
+        if job.file_path:
+            try:
+                os.remove(job.file_path)
+            except OSError:
+                pass
+
+    # Only report the job finished once it has cleaned up after itself
+    job.status = status
+
+def _expire_jobs():
+    """Forget jobs that finished more than JOB_EXPIRY seconds ago."""
+
+    cutoff = time.time() - JOB_EXPIRY
+    for job_id, job in _jobs.items():
+        if job.finished and job.finished < cutoff:
+            del _jobs[job_id]
+
+def submit(name, owner_id, func, *args, **kwargs):
+    """Queue func(*args, progress=callback, **kwargs) on the background pool.
+    Return the new job's ID."""
+
+    return _submit(Job(name, owner_id), func, args, kwargs)
+
+def submit_file(name, owner_id, file_path, func, *args, **kwargs):
+    """Queue func(file_path, *args, progress=callback, **kwargs) like submit,
+    and delete the file at file_path when the job finishes. Return the new
+    job's ID."""
+
+    return _submit(Job(name, owner_id, file_path), func, (file_path,) + args, kwargs)
+
+def _submit(job, func, args, kwargs):
+    with _lock:
+        _expire_jobs()
+        _jobs[job.id] = job
+
+    _get_pool().apply_async(_run, (job, func, args, kwargs))
+
+    return job.id
+
+def get_job(job_id, owner_id):
+    """Return the status of a job owned by owner_id, or None if there is no
+    such job."""
+
+    job = _jobs.get(job_id)
+    if job is None or job.owner_id != owner_id:
+        return None
+    return job.to_dict()
@@ -1,8 +1,8 @@
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine
-from sqlalchemy import Column, Integer, String, Date, Text, Float
+from sqlalchemy import Column, Integer, SmallInteger, String, Date, Text, Float
 from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import relationship, backref
 import config
 
@@ -14,6 +14,20 @@ session = scoped_session(sessionmaker(bind=engine, autocommit=False, autoflush=F
 ########### END SESSION ###########
 
 
+########### SCORE VALUES ###########
+
+# Scores are stored as small integers, which are also the "3"/"2"/"1" keys
+# the reports use; these map them to and from the M/A/FB labels in test files
+MASTERED = 3
+ALMOST = 2
+FALLING_BEHIND = 1
+
+SCORE_VALUES = {"M": MASTERED, "A": ALMOST, "FB": FALLING_BEHIND}
+SCORE_LABELS = {MASTERED: "M", ALMOST: "A", FALLING_BEHIND: "FB"}
+
+########### END SCORE VALUES ###########
+
+
 ########### CLASS DEFINITIONS ###########
 
 Base = declarative_base()
@@ -29,6 +43,11 @@ class User(Base):
     first_name = Column(String(64))
     last_name = Column(String(64))
 
+    # Student names are matched on (last_name, first_name) during test upload,
+    # and teachers log in by email, which must be unique
+    __table_args__ = (Index("ix_users_last_name_first_name", "last_name", "first_name"),
+                      Index("ix_users_email", "email", unique=True))
+
 class Cohort(Base):
     __tablename__ = "cohorts"
 
@@ -59,12 +78,15 @@ class Test(Base):
 
     cohort = relationship("Cohort", backref=backref("tests", order_by=id))
 
+    # Reports look up each cohort's tests by date
+    __table_args__ = (Index("ix_tests_cohort_id_test_date", "cohort_id", "test_date"),)
+
 class Standard(Base):
     __tablename__ = "standards"
 
     id = Column(Integer, primary_key = True, index=True)
     category = Column(String(64))
-    code = Column(String(64))
+    code = Column(String(64), unique=True, index=True)
     description = Column(Text)
 
 class Score(Base):
@@ -74,12 +96,18 @@ class Score(Base):
     student_id = Column(Integer, ForeignKey('users.id'))
     test_id = Column(Integer, ForeignKey('tests.id'))
     standard_id = Column(Integer, ForeignKey('standards.id'))
-    score = Column(String(20))
+    score = Column(SmallInteger)
 
     student = relationship("User", backref=backref("scores", order_by=id))
     test = relationship("Test", backref=backref("scores", order_by=id))
     standard = relationship("Standard", backref=backref("scores", order_by=id))
 
+    # Reports read scores by test and standard, by test and student, or by
+    # student; score is included so counts can be answered from the index
+    __table_args__ = (Index("ix_scores_test_id_standard_id", "test_id", "standard_id", "score"),
+                      Index("ix_scores_test_id_student_id", "test_id", "student_id", "score"),
+                      Index("ix_scores_student_id", "student_id"))
+
 class NormScore(Base):
     __tablename__ = "normscores"
 
@@ -92,14 +120,126 @@ class NormScore(Base):
     test = relationship("Test", backref=backref("normscores", order_by=id))
     standard = relationship("Standard", backref=backref("normscores", order_by=id))
 
+    # Norm comparisons read a test's normscores standard by standard
+    __table_args__ = (Index("ix_normscores_test_id_standard_id", "test_id", "standard_id"),)
+
+class StandardSummary(Base):
+    __tablename__ = "standardsummaries"
+
+    # Counts of each score for one standard on one test, written alongside the
+    # scores at upload, so reports don't have to count the scores themselves
+    id = Column(Integer, primary_key = True, index=True)
+    test_id = Column(Integer, ForeignKey('tests.id'))
+    standard_id = Column(Integer, ForeignKey('standards.id'))
+    mastered = Column(Integer)
+    almost = Column(Integer)
+    falling_behind = Column(Integer)
+    falling_behind_ids = Column(Text)
+
+    test = relationship("Test", backref=backref("standardsummaries", order_by=id))
+    standard = relationship("Standard", backref=backref("standardsummaries", order_by=id))
+
+    __table_args__ = (Index("ix_standardsummaries_test_id_standard_id", "test_id", "standard_id"),)
+
+class StudentSummary(Base):
+    __tablename__ = "studentsummaries"
+
+    # Counts of each score for one student on one test, written at upload
+    id = Column(Integer, primary_key = True, index=True)
+    test_id = Column(Integer, ForeignKey('tests.id'))
+    student_id = Column(Integer, ForeignKey('users.id'))
+    mastered = Column(Integer)
+    almost = Column(Integer)
+    falling_behind = Column(Integer)
+
+    test = relationship("Test", backref=backref("studentsummaries", order_by=id))
+    student = relationship("User", backref=backref("studentsummaries", order_by=id))
+
+    __table_args__ = (Index("ix_studentsummaries_student_id_test_id", "student_id", "test_id"),
+                      Index("ix_studentsummaries_test_id", "test_id"))
+
+class DataVersion(Base):
+    __tablename__ = "dataversions"
+
+    # Bumped whenever a teacher's classes, rosters, or scores change, so
+    # reports cached for an older version are never served
+    teacher_id = Column(Integer, ForeignKey('users.id'), primary_key = True)
+    version = Column(Integer, default=0)
+
 ########### END CLASS DEFINITIONS ###########
 
 
+def join_ids(ids):
+    """Store a list of IDs as comma-separated text."""
+
+    return ",".join([str(i) for i in ids])
+
+def split_ids(text):
+    """Read a list of IDs back from join_ids."""
+
+    if not text:
+        return []
+    return [int(i) for i in text.split(",")]
+
+
 def create_tables():
     Base.metadata.create_all(engine)
 
+def create_indexes():
+    """Create any index defined above that is missing from an existing database,
+    since create_all only builds indexes along with new tables."""
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            unique = "UNIQUE " if index.unique else ""
+            columns = ", ".join([column.name for column in index.columns])
+            engine.execute("CREATE %sINDEX IF NOT EXISTS %s ON %s (%s)" % (unique, index.name, table.name, columns))
+
+def encode_scores():
+    """Convert scores stored by earlier versions as "M"/"A"/"FB" strings to
+    their integer values. Safe to run more than once."""
+
+    cases = " ".join(["WHEN '%s' THEN %d" % (label, value) for label, value in SCORE_VALUES.items()])
+
+    if engine.dialect.name == "postgresql":
+        data_type = engine.execute("SELECT data_type FROM information_schema.columns "
+                                   "WHERE table_name = 'scores' AND column_name = 'score'").scalar()
+        if data_type != "smallint":
+            engine.execute("ALTER TABLE scores ALTER COLUMN score TYPE SMALLINT USING CASE score %s END" % cases)
+
+    # Other engines keep whatever type they're given, so rewrite the values in place
+    else:
+        engine.execute("UPDATE scores SET score = CASE score %s ELSE score END" % cases)
+
+def summarize_scores():
+    """Write the standard and student summaries of any test that has scores
+    but no summaries yet, such as tests uploaded before summaries existed."""
+
+    counts = ("SUM(CASE WHEN score = %d THEN 1 ELSE 0 END), "
+              "SUM(CASE WHEN score = %d THEN 1 ELSE 0 END), "
+              "SUM(CASE WHEN score = %d THEN 1 ELSE 0 END)" % (MASTERED, ALMOST, FALLING_BEHIND))
+
+    if engine.dialect.name == "postgresql":
+        fb_ids = "COALESCE(string_agg(CASE WHEN score = %d THEN student_id::text END, ',' ORDER BY id), '')"
+    else:
+        fb_ids = "COALESCE(group_concat(CASE WHEN score = %d THEN student_id END, ','), '')"
+
+    engine.execute("INSERT INTO standardsummaries (test_id, standard_id, mastered, almost, falling_behind, falling_behind_ids) "
+                   "SELECT test_id, standard_id, %s, %s "
+                   "FROM scores WHERE test_id NOT IN (SELECT test_id FROM standardsummaries) "
+                   "GROUP BY test_id, standard_id ORDER BY MIN(id)"
+                   % (counts, fb_ids % FALLING_BEHIND))
+
+    engine.execute("INSERT INTO studentsummaries (test_id, student_id, mastered, almost, falling_behind) "
+                   "SELECT test_id, student_id, %s "
+                   "FROM scores WHERE test_id NOT IN (SELECT test_id FROM studentsummaries) "
+                   "GROUP BY test_id, student_id ORDER BY MIN(id)" % counts)
+
 def main():
     create_tables()
+    encode_scores()
+    create_indexes()
+    summarize_scores()
 
 if __name__ == "__main__":
     main()
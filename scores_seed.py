@@ -1,4 +1,5 @@
 import model
+import api
 import csv
 from datetime import datetime
 
@@ -33,38 +34,11 @@ def load_test_file(session, name, date, cohort_id):
             scores.append(rows[1:-2])
             norm_scores.append(rows[-2:])
 
-        # Create list of standard IDs
+        # Create list of standard IDs, resolved through the standards index
         standard_ids = []
+        new_standards = {}
         for standard in standards:
-            # Split standard on the space and only take the code
-            standard_split = standard.split(" ")
-            standard_code = standard_split[0]
-
-            # Query the DB using the code to see if the standard exists
-            standard = model.Standard.query.filter_by(code=standard_code).first()
-
-            # If the standard doesn't exist, add it to the DB
-            if standard == None:
-                categories = {'RF': 'Foundational Skills',
-                              'RI': 'Informational Text',
-                              'L': 'Language',
-                              'RL': 'Literature',
-                              'SL': 'Speaking and Listening',
-                              'W': 'Writing'}
-                cat_code = (standard_code.split("."))[0]
-                description = ' '.join(standard_split[1:])
-                stan = model.Standard(category=categories[cat_code], code=standard_code, description=description)
-                session.add(stan)
-                session.commit()
-
-                # Once it's added, get its ID and add to the standard IDs list
-                standard = model.Standard.query.filter_by(code=standard_code).first()
-                standard_id = standard.id
-                standard_ids.append(standard_id)
-
-            # If it already exists, get the ID and append it to the standard IDs list
-            standard_id = standard.id
-            standard_ids.append(standard_id)
+            standard_ids.append(api.get_standard_id(standard, new_standards))
 
         # Create list of student IDs
         student_ids = []
@@ -97,7 +71,7 @@ def load_test_file(session, name, date, cohort_id):
         for student in student_ids:
             i = 0
             for standard in standard_ids:
-                score = scores[i][j]
+                score = model.SCORE_VALUES[scores[i][j]]
                 new_score = model.Score(student_id=student, test_id=test_id, standard_id=standard, score=score)
                 session.add(new_score)
                 i += 1
@@ -114,9 +88,11 @@ def load_test_file(session, name, date, cohort_id):
             j += 1
 
         session.commit()
+        api.publish_standards(new_standards)
 
 def main(session):
     load_test_file(session, name, date, cohort_id)
+    model.summarize_scores()
 
 if __name__ == "__main__":
     main(model.session)
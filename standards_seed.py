@@ -1,18 +1,86 @@
 import model
+import api
+import bulk
 import csv
+from sqlalchemy import bindparam
+from sqlalchemy.sql import table
 
-def load_standards(session):
+COLUMNS = ("category", "code", "description")
+
+def read_standards():
+    """Read the CCSS catalog into a list of (category, code, description),
+    keeping the last row for any code listed twice."""
 
+    standards = {}
+    order = []
     with open('seed_data/ccss.tsv', 'rb') as f:
         reader = csv.reader(f, delimiter='\t')
         for row in reader:
-            standard = model.Standard(category = row[1], code = row[2], description = row[3])
-            session.add(standard)
+            if row[2] not in standards:
+                order.append(row[2])
+            standards[row[2]] = (row[1], row[2], row[3])
+
+    return [standards[code] for code in order]
+
+def dedupe_standards(session):
+    """Point scores, normscores, and summaries at the oldest copy of each standard that
+    was loaded more than once, then delete the other copies, so a unique
+    index can be built on standards.code."""
 
+    oldest = "(SELECT MIN(s2.id) FROM standards s1 JOIN standards s2 ON s2.code = s1.code WHERE s1.id = %s.standard_id)"
+    duplicates = "(SELECT s.id FROM standards s WHERE s.id > (SELECT MIN(s2.id) FROM standards s2 WHERE s2.code = s.code))"
+
+    for table_name in ("scores", "normscores", "standardsummaries"):
+        session.execute("UPDATE %s SET standard_id = %s WHERE standard_id IN %s" % (table_name, oldest % table_name, duplicates))
+    session.execute("DELETE FROM standards WHERE id IN %s" % duplicates)
     session.commit()
 
+def load_standards(session):
+    """Upsert the CCSS catalog on standards.code, so running it again updates
+    the catalog in place instead of duplicating it. On Postgres the catalog is
+    copied into a temporary table and merged with one INSERT ... ON CONFLICT."""
+
+    standards = read_standards()
+
+    if bulk.is_postgres(session):
+        session.execute("CREATE TEMPORARY TABLE standards_load (category VARCHAR(64), code VARCHAR(64), description TEXT) ON COMMIT DROP")
+        bulk.copy_rows(session, table("standards_load"), COLUMNS, standards)
+        session.execute("INSERT INTO standards (category, code, description) "
+                        "SELECT category, code, description FROM standards_load "
+                        "ON CONFLICT (code) DO UPDATE SET category = EXCLUDED.category, description = EXCLUDED.description")
+
+    else:
+        # Compare against the current catalog to find new and changed standards
+        existing = {}
+        for standard_id, category, code, description in session.query(model.Standard.id, model.Standard.category,
+                                                                        model.Standard.code, model.Standard.description):
+            existing[code] = (standard_id, category, description)
+
+        new_standards = []
+        changed = []
+        for category, code, description in standards:
+            if code not in existing:
+                new_standards.append((category, code, description))
+            elif existing[code][1:] != (category, description):
+                changed.append({"b_id": existing[code][0], "b_category": category, "b_description": description})
+
+        bulk.insert_rows(session, model.Standard.__table__, COLUMNS, new_standards)
+        if changed:
+            standards_table = model.Standard.__table__
+            session.execute(standards_table.update().
+                            where(standards_table.c.id == bindparam("b_id")).
+                            values(category=bindparam("b_category"), description=bindparam("b_description")),
+                            changed)
+
+    session.commit()
+
+    # Codes may have been added, so rebuild the index on next use
+    api.reset_standards_index()
+
 def main(session):
+    dedupe_standards(session)
+    model.create_indexes()
     load_standards(session)
 
 if __name__ == "__main__":
-    main(model.session)
\ No newline at end of file
+    main(model.session)
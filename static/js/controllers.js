@@ -158,69 +158,81 @@ clarityControllers.controller('SettingsController', ['$scope', '$http', 'ModalSe
 //// Controller for reports ////
 ////////////////////////////////
 
-clarityControllers.controller('ReportsController', ['$scope', '$http', 'ModalService', function($scope, $http, ModalService) {
+clarityControllers.controller('ReportsController', ['$scope', '$http', '$location', '$timeout', 'ModalService', function($scope, $http, $location, $timeout, ModalService) {
 
     // Default selections to zero
     $scope.selectedCohort = 0;
     $scope.selectedStudent = 0;
 
+    // Reports for each class and student, loaded the first time they're picked
+    $scope.cohortDataByCohort = {};
+    $scope.studentDataByStudent = {};
+
     // When cohort is changed, set student value to null
     $scope.onChange = function(value) {
         $scope.selectedStudent = null;
+        if (value && !$scope.cohortDataByCohort[value]) {
+            $http.get("/api/cohorts/" + value + "/reports/").success(function(data) {
+                $scope.cohortDataByCohort[value] = data;
+            });
+        }
     };
 
     // When student is change, set cohort value to null
     $scope.onStudChange = function(value) {
         $scope.selectedCohort = null;
+        if (value && !$scope.studentDataByStudent[value]) {
+            $http.get("/api/students/" + value + "/reports/").success(function(data) {
+                $scope.studentDataByStudent[value] = data;
+            });
+        }
     };
 
-    // Get the teacher's cohorts
-    $http.get("/api/getclasses/").success(function(data) {
-        $scope.cohorts = data;
-    });
+    // If we came back from an upload, poll its job until it finishes
+    var pollJob = function(jobId) {
+        $http.get("/api/jobs/" + jobId + "/").success(function(data) {
+            $scope.uploadJob = data;
+            if (data.status === "queued" || data.status === "running") {
+                $timeout(function() { pollJob(jobId); }, 1000);
+            } else if (data.status === "done") {
+                // Clearing the job from the URL reloads the reports with the new data
+                $location.search("job", null);
+            }
+        });
+    };
 
-    // Top standards students are struggling with
-    $http.get("/api/allcohortstopfb/").success(function(data) {
-        $scope.allCohortsTopFB = data.slice(0, 5);
-        $scope.allCohortsTopFBAll = data;
-        $scope.orderByField = 'percent';
-    });
+    if ($location.search().job) {
+        pollJob($location.search().job);
+    }
 
-    // Overall pie chart data of most recent test
-    $http.get("/api/allcohortspie/").success(function(data) {
-        $scope.allCohortsPie = data;
-    });
+    // Get every report on the dashboard in one request
+    $http.get("/api/dashboard/").success(function(data) {
 
-    // Bar graph data comparing all students to school/district
-    $http.get("/api/allcohortsnorm/").success(function(data) {
-        $scope.allCohortsNorm = data;
-    });
+        // The teacher's cohorts
+        $scope.cohorts = data.cohorts;
 
-    // All data from all tests for stacked bar graph
-    $http.get("/api/allcohortscounts/").success(function(data) {
-        $scope.allCohortsData = data;
-    });
+        // A report that failed to build comes back as null
+        // Top standards students are struggling with
+        $scope.allCohortsTopFB = (data.allCohortsTopFB || []).slice(0, 5);
+        $scope.allCohortsTopFBAll = data.allCohortsTopFB || [];
+        $scope.orderByField = 'percent';
 
-    // Most recent test broken out by standard
-    $http.get("/api/allcohortsbystandard/").success(function(data) {
-        $scope.allStandard = data;
-        $scope.tableStandard = angular.copy(data);
-    });
+        // Overall pie chart data of most recent test
+        $scope.allCohortsPie = data.allCohortsPie;
 
-    // Top students who are struggling to meet standards
-    $http.get("/api/allcohortsstudents/").success(function(data) {
-        $scope.allCohortsStudents = data.slice(0,10);
-        $scope.orderByValue = '-total';
-    });
+        // Bar graph data comparing all students to school/district
+        $scope.allCohortsNorm = data.allCohortsNorm;
 
-    // Get all cohort data by cohort
-    $http.get("/api/allsinglecohortdata/").success(function(data) {
-        $scope.cohortDataByCohort = data;
-    });
+        // All data from all tests for stacked bar graph
+        $scope.allCohortsData = data.allCohortsData;
 
-    // Get all student data by student
-    $http.get("/api/allsinglestudentdata/").success(function(data) {
-        $scope.studentDataByStudent = data;
+        // Most recent test broken out by standard
+        $scope.allStandard = data.allStandard || [];
+        $scope.tableStandard = angular.copy($scope.allStandard);
+
+        // Top students who are struggling to meet standards
+        $scope.allCohortsStudents = (data.allCohortsStudents || []).slice(0,10);
+        $scope.orderByValue = '-total';
     });
 
 }]);
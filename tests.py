@@ -1,8 +1,21 @@
 import unittest
+import json
 import os
+import shutil
 import tempfile
 import app
 import api
+import bulk
+import cache
+import config
+import cube
+import jobs
+import model
+import standards_seed
+import time
+import zlib
+from datetime import datetime
+from StringIO import StringIO
 from random import randint
 
 class FlaskrTestCase(unittest.TestCase):
@@ -20,6 +33,26 @@ class FlaskrTestCase(unittest.TestCase):
         response = self.app.get("/")
         self.assertIn("CommonClarity", response.data)
 
+    def testUploadBatchWithoutZip(self):
+        with self.app.session_transaction() as flask_session:
+            flask_session['user'] = 84
+        self.assertEqual(self.app.get("/uploadbatch/").status_code, 400)
+        response = self.app.post("/uploadbatch/", data={"cohort": "6", "batchfile": (StringIO("a,b"), "interim.csv")})
+        self.assertEqual(response.status_code, 400)
+
+    def testSharedStudentChangeInvalidatesReportETag(self):
+        with self.app.session_transaction() as flask_session:
+            flask_session['user'] = 84
+        etag = self.app.get("/api/getclasses/").headers['ETag']
+        self.assertEqual(self.app.get("/api/getclasses/", headers={'If-None-Match': etag}).status_code, 304)
+
+        # Another teacher's change to a student teacher 84 shares
+        api.bump_shared_data_versions([], [86])
+        model.session.commit()
+        response = self.app.get("/api/getclasses/", headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
 class TestAPIEndpoints(unittest.TestCase):
 
     def testGetUser(self):
@@ -61,5 +94,516 @@ class TestAPIEndpoints(unittest.TestCase):
         cohorts = [{'cohort_id': 6, 'students': [{'name': u'Jane Doe', 'id': 86}], 'name': u'Test Class'}]
         self.assertEqual(api.get_teacher_cohorts(teacher_id), cohorts)
 
+    def testSharedStudentBumpsTheirTeachers(self):
+        teacher_id = 84
+        student_id = 86
+        version = api.get_data_version(teacher_id)
+        api.bump_shared_data_versions([], [student_id])
+        self.assertEqual(api.get_data_version(teacher_id), version + 1)
+        model.session.rollback()
+
+    def testBumpNewTeacherVersion(self):
+        teacher = model.User(user_type="teacher", first_name="New", last_name="Teacher")
+        model.session.add(teacher)
+        model.session.flush()
+        api.bump_data_version(teacher.id)
+        api.bump_data_version(teacher.id)
+        self.assertEqual(api.get_data_version(teacher.id), 2)
+        model.session.rollback()
+
+    def testGetStudentIndex(self):
+        teacher_id = 84
+        index = {"page": 1, "per_page": 50, "total": 1, "items": [{"id": 86, "name": u"Jane Doe"}]}
+        self.assertEqual(api.get_student_index(teacher_id, 1, 50), index)
+
+    def testGetCohortReportsOtherTeacher(self):
+        teacher_id = 85
+        cohort_id = 6
+        self.assertEqual(api.get_cohort_reports(teacher_id, cohort_id), None)
+
+class TestStandardsIndex(unittest.TestCase):
+
+    def testNewStandardNotSharedUntilPublished(self):
+        new_standards = {}
+        standard_id = api.get_standard_id("RL.99.1 A standard added by this test", new_standards)
+        self.assertEqual(new_standards, {"RL.99.1": standard_id})
+        self.assertNotIn("RL.99.1", api._standard_ids)
+        model.session.rollback()
+
+class TestTestFileParsing(unittest.TestCase):
+
+    def testParseTestHeader(self):
+        headers = ["Interim #1", "Gilmore, Emily", "Taylor,Tami", "Frederick Pilot Middle", "Boston Public Schools"]
+        students, norms = api._parse_test_header(headers)
+        self.assertEqual(students, [("Gilmore", "Emily"), ("Taylor", "Tami")])
+        self.assertEqual(norms, ["Frederick Pilot Middle", "Boston Public Schools"])
+
+class TestBatchImportParsing(unittest.TestCase):
+
+    HEADER = 'Interim #1,"Gilmore, Emily","Taylor, Tami",Frederick Pilot Middle,Boston Public Schools\n'
+
+    def setUp(self):
+        self.batch_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.batch_dir)
+
+    def writeFile(self, file_name, contents):
+        file_path = os.path.join(self.batch_dir, file_name)
+        with open(file_path, 'wb') as f:
+            f.write(contents)
+        return file_path
+
+    def testParseValidFile(self):
+        file_path = self.writeFile("interim.csv", self.HEADER + "RL.5.1 Quote accurately,M,FB,0.5,0.75\n")
+        test_file = api._parse_test_file(file_path)
+        self.assertEqual(test_file["errors"], [])
+        self.assertEqual(test_file["name"], "Interim #1")
+        self.assertEqual(test_file["students"], [("Gilmore", "Emily"), ("Taylor", "Tami")])
+        self.assertEqual(test_file["norms"], ["Frederick Pilot Middle", "Boston Public Schools"])
+        self.assertEqual(test_file["rows"], [("RL.5.1 Quote accurately", ["M", "FB"], ["0.5", "0.75"])])
+
+    def testParseWrongScoreCount(self):
+        file_path = self.writeFile("interim.csv", self.HEADER + "RL.5.1 Quote accurately,M,0.5,0.75\n")
+        self.assertEqual(api._parse_test_file(file_path)["errors"],
+                         ["interim.csv: row for RL.5.1 has 1 scores for 2 students."])
+
+    def testParseInvalidLabel(self):
+        file_path = self.writeFile("interim.csv", self.HEADER + "RL.5.1 Quote accurately,M,X,0.5,0.75\n")
+        self.assertEqual(api._parse_test_file(file_path)["errors"],
+                         ["interim.csv: row for RL.5.1 has invalid scores X."])
+
+    def testParseNonNumericNorms(self):
+        file_path = self.writeFile("interim.csv", self.HEADER + "RL.5.1 Quote accurately,M,A,half,0.75\n")
+        self.assertEqual(api._parse_test_file(file_path)["errors"],
+                         ["interim.csv: row for RL.5.1 has non-numeric norm scores."])
+
+    def testManifestOverridesFile(self):
+        self.writeFile("manifest.csv", "file,test_name,test_date,cohort_id\ninterim.csv,Winter Interim,2015-01-15,7\n")
+        self.writeFile("interim.csv", self.HEADER)
+        self.assertEqual(api._read_test_manifest(self.batch_dir), {"interim.csv": ("Winter Interim", "2015-01-15", "7")})
+        self.assertEqual(api._find_test_files(self.batch_dir), [os.path.join(self.batch_dir, "interim.csv")])
+
+    def testNoManifest(self):
+        self.assertEqual(api._read_test_manifest(self.batch_dir), {})
+
+    def testBatchRejectsOtherTeachersClass(self):
+        own = model.Cohort(name="Own Class", teacher_id=84)
+        other = model.Cohort(name="Other Class", teacher_id=85)
+        model.session.add_all([own, other])
+        model.session.flush()
+        self.writeFile("manifest.csv", "file,test_name,test_date,cohort_id\ninterim.csv,Winter Interim,2015-01-15,%d\n" % other.id)
+        self.writeFile("interim.csv", self.HEADER + "RL.5.1 Quote accurately,M,FB,0.5,0.75\n")
+        self.writeFile("spring.csv", self.HEADER + "RL.5.1 Quote accurately,M,A,0.5,0.75\n")
+        try:
+            with self.assertRaises(ValueError) as raised:
+                api.import_test_batch(self.batch_dir, 84, own.id, "2015-04-15")
+            self.assertEqual(str(raised.exception), "interim.csv: class %d is not one of your classes." % other.id)
+        finally:
+            model.session.rollback()
+
+class TestStandardsSeed(unittest.TestCase):
+
+    def testReadStandardsUniqueCodes(self):
+        standards = standards_seed.read_standards()
+        codes = [code for category, code, description in standards]
+        self.assertEqual(len(codes), len(set(codes)))
+
+class TestScoreValues(unittest.TestCase):
+
+    def testScoreValuesMatchReportKeys(self):
+        self.assertEqual(model.SCORE_VALUES, {"M": 3, "A": 2, "FB": 1})
+        for label, value in model.SCORE_VALUES.items():
+            self.assertEqual(model.SCORE_LABELS[value], label)
+
+class TestStandardSummaries(unittest.TestCase):
+
+    def testFallingBehindIdsRoundTrip(self):
+        self.assertEqual(model.split_ids(model.join_ids([86, 4, 12])), [86, 4, 12])
+        self.assertEqual(model.split_ids(model.join_ids([])), [])
+
+class TestScoreCube(unittest.TestCase):
+
+    def setUp(self):
+        # A class of three scored students and one who missed both tests,
+        # rolled back after each test
+        cohort = model.Cohort(name="Cube Class", teacher_id=84)
+        students = [model.User(user_type="student", first_name=first_name, last_name="Cube")
+                    for first_name in ("Ann", "Bo", "Cy", "Di")]
+        model.session.add_all([cohort] + students)
+        model.session.flush()
+        model.session.add_all([model.StudentCohort(student_id=student.id, cohort_id=cohort.id) for student in students])
+
+        first = model.Test(name="Interim #1", test_date=datetime(2014, 10, 1), cohort_id=cohort.id)
+        second = model.Test(name="Interim #2", test_date=datetime(2014, 11, 1), cohort_id=cohort.id)
+        model.session.add_all([first, second])
+        model.session.flush()
+
+        self.student_ids = [student.id for student in students]
+        self.test_ids = [first.id, second.id]
+        scored = self.student_ids[:3]
+        norms = ["School", "District"]
+        new_standards = {}
+        api.load_test_rows(first.id, scored, norms, [("RL.5.2 Theme", ["M", "A", "FB"], ["0.5", "0.6"]),
+                                                     ("RL.5.1 Quote", ["FB", "FB", "M"], ["0.4", "0.5"])],
+                           False, new_standards=new_standards)
+        api.load_test_rows(second.id, scored, norms, [("RL.5.1 Quote", ["M", "M", "A"], ["0.7", "0.8"])],
+                           False, new_standards=new_standards)
+        model.session.flush()
+        self.cube = cube.ScoreCube(cohort.id)
+
+    def tearDown(self):
+        model.session.rollback()
+
+    def testUniqueKeepsFirstOfEach(self):
+        self.assertEqual(cube._unique([86, 4, 86, 12, 4]), [86, 4, 12])
+
+    def testCountByTestMatchesSummaries(self):
+        self.assertEqual(self.cube.count_by_test(), api.count_scores("test", test_ids=self.test_ids))
+        self.assertEqual(self.cube.count_test(self.test_ids[0]), {3: 2, 2: 1, 1: 3})
+
+    def testCountByStudentMatchesSummaries(self):
+        counts = api.count_scores("student", test_ids=self.test_ids)
+        counts[self.student_ids[3]] = {3: 0, 2: 0, 1: 0}
+        self.assertEqual(self.cube.count_by_student(), counts)
+
+    def testSummarizeStandardsMatchesSummaries(self):
+        standards = self.cube.summarize_standards(self.test_ids[0])
+        self.assertEqual(standards, api._summarize_standards([self.test_ids[0]]))
+
+        # Standards are listed in file order, with who fell behind on each
+        self.assertEqual([standard["name"] for standard in standards], ["RL.5.2", "RL.5.1"])
+        self.assertEqual([standard["falling_behind_ids"] for standard in standards],
+                         [[self.student_ids[2]], self.student_ids[:2]])
+
+    def testStudentReportsFromSummaries(self):
+        by_test = api.student_data_by_test(self.student_ids[0])
+        self.assertEqual([(test["name"], test["3"], test["2"], test["1"]) for test in by_test],
+                         [("All Tests", 2, 0, 1), ("Interim #1", 1, 0, 1), ("Interim #2", 1, 0, 0)])
+        struggles = api.student_top_struggle_standards(self.student_ids[2])
+        self.assertEqual([(standard["name"], standard["score"]) for standard in struggles], [("RL.5.1", "A")])
+
+class TestParseCSV(unittest.TestCase):
+
+    HEADER = 'Interim #1,"Gilmore, Emily","Taylor, Tami",Frederick Pilot Middle,Boston Public Schools\n'
+
+    def setUp(self):
+        # parse_CSV commits, so flush instead and roll back after each test.
+        # Small chunks make a short file flush more than once.
+        self.commit = model.session.commit
+        model.session.commit = model.session.flush
+        self.chunk_size = config.INGEST_CHUNK_SIZE
+        config.INGEST_CHUNK_SIZE = 4
+
+        cohort = model.Cohort(name="Upload Class", teacher_id=84)
+        model.session.add(cohort)
+        model.session.flush()
+        self.cohort_id = cohort.id
+
+        fd, self.file_path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.file_path)
+        config.INGEST_CHUNK_SIZE = self.chunk_size
+        model.session.commit = self.commit
+        model.session.rollback()
+
+    def writeFile(self, rows):
+        with open(self.file_path, 'wb') as f:
+            f.write(self.HEADER + "".join(rows))
+
+    def testChunksReportRunningTotals(self):
+        self.writeFile(["RL.5.%d Standard,M,FB,0.5,0.75\n" % i for i in range(1, 6)])
+        written = []
+        result = api.parse_CSV(self.file_path, "Interim #1", "2014-10-01", self.cohort_id, progress=written.append)
+        self.assertEqual(result["scores"], 10)
+        self.assertEqual(written, [4, 8, 10])
+        self.assertEqual(model.Score.query.filter_by(test_id=result["test_id"]).count(), 10)
+        self.assertEqual(model.StandardSummary.query.filter_by(test_id=result["test_id"]).count(), 5)
+        self.assertEqual(sorted((summary.mastered, summary.falling_behind) for summary in
+                                model.StudentSummary.query.filter_by(test_id=result["test_id"])), [(0, 5), (5, 0)])
+
+    def testWrongScoreCount(self):
+        self.writeFile(["RL.5.1 Standard,M,FB,0.5,0.75\n", "RL.5.2 Standard,M,0.5,0.75\n"])
+        with self.assertRaises(ValueError) as raised:
+            api.parse_CSV(self.file_path, "Interim #1", "2014-10-01", self.cohort_id)
+        self.assertEqual(str(raised.exception), "Row for RL.5.2 has 1 scores for 2 students.")
+
+        # Nothing from the file is left behind
+        self.assertEqual(model.Test.query.filter_by(cohort_id=self.cohort_id).count(), 0)
+
+    def testUnknownLabel(self):
+        self.writeFile(["RL.5.1 Standard,M,X,0.5,0.75\n"])
+        with self.assertRaises(ValueError) as raised:
+            api.parse_CSV(self.file_path, "Interim #1", "2014-10-01", self.cohort_id)
+        self.assertEqual(str(raised.exception), "Row for RL.5.1 has invalid score 'X'.")
+
+class TestAddRoster(unittest.TestCase):
+
+    def setUp(self):
+        # add_roster_to_cohort commits, so flush instead and roll back after
+        # each test
+        self.commit = model.session.commit
+        model.session.commit = model.session.flush
+
+        self.cohort = model.Cohort(name="Roster Class", teacher_id=84)
+        other = model.Cohort(name="Other Roster Class", teacher_id=85)
+        self.existing = model.User(user_type="student", first_name="Cy", last_name="Roster")
+        model.session.add_all([self.cohort, other, self.existing])
+        model.session.flush()
+        model.session.add(model.StudentCohort(student_id=self.existing.id, cohort_id=other.id))
+        model.session.flush()
+
+    def tearDown(self):
+        model.session.commit = self.commit
+        model.session.rollback()
+
+    def linkedIds(self):
+        return [student_id for (student_id,) in model.session.query(model.StudentCohort.student_id).
+                filter_by(cohort_id=self.cohort.id).order_by(model.StudentCohort.id)]
+
+    def testNewStudentsAreCreatedAndLinked(self):
+        student_ids = api.add_roster_to_cohort(self.cohort.id, [("Ann", "Roster"), ("Bo", "Roster")])
+        self.assertEqual([(student.first_name, student.last_name) for student in
+                          [model.User.query.get(student_id) for student_id in student_ids]],
+                         [("Ann", "Roster"), ("Bo", "Roster")])
+        self.assertEqual(self.linkedIds(), student_ids)
+
+    def testExistingStudentIsLinked(self):
+        student_ids = api.add_roster_to_cohort(self.cohort.id, [("Cy", "Roster")])
+        self.assertEqual(student_ids, [self.existing.id])
+        self.assertEqual(self.linkedIds(), [self.existing.id])
+        self.assertEqual(model.User.query.filter_by(first_name="Cy", last_name="Roster").count(), 1)
+
+    def testStudentIdsMatchNamePairs(self):
+        # Cy Roster exists; Ann Roster and Cy Other don't, though each shares
+        # a name with someone in the list
+        student_ids = api._get_student_ids([("Other", "Cy"), ("Roster", "Cy"), ("Roster", "Ann"), ("Other", "Cy")])
+        self.assertEqual(student_ids[1], self.existing.id)
+        self.assertEqual(student_ids[0], student_ids[3])
+        self.assertEqual(len(set(student_ids)), 3)
+
+        # New students are added in header order
+        self.assertTrue(self.existing.id < student_ids[0] < student_ids[2])
+        self.assertEqual([(model.User.query.get(student_id).first_name, model.User.query.get(student_id).last_name)
+                          for student_id in student_ids], [("Cy", "Other"), ("Cy", "Roster"), ("Ann", "Roster"),
+                                                           ("Cy", "Other")])
+
+    def testRepeatedStudentIsLinkedOnce(self):
+        student_ids = api.add_roster_to_cohort(self.cohort.id, [("Ann", "Roster"), ("Cy", "Roster"), ("Ann", "Roster")])
+        self.assertEqual(student_ids[0], student_ids[2])
+        self.assertEqual(self.linkedIds(), student_ids[:2])
+
+        # Adding the roster again links nobody new
+        self.assertEqual(api.add_roster_to_cohort(self.cohort.id, [("Ann", "Roster")]), student_ids[:1])
+        self.assertEqual(self.linkedIds(), student_ids[:2])
+
+class TestEmptyClassReports(unittest.TestCase):
+
+    def setUp(self):
+        # A new teacher with a class that hasn't taken any tests, rolled back
+        # after each test. Reports are built here rather than in the report
+        # pool, whose sessions can't see the uncommitted class.
+        teacher = model.User(user_type="teacher", first_name="Empty", last_name="Teacher")
+        student = model.User(user_type="student", first_name="Ed", last_name="Empty")
+        model.session.add_all([teacher, student])
+        model.session.flush()
+        cohort = model.Cohort(name="Empty Class", teacher_id=teacher.id)
+        model.session.add(cohort)
+        model.session.flush()
+        model.session.add(model.StudentCohort(student_id=student.id, cohort_id=cohort.id))
+        model.session.flush()
+        self.teacher_id = teacher.id
+        self.cohort_id = cohort.id
+        self.student_id = student.id
+
+        # Rolled back IDs can be used again, so don't serve an earlier test's reports
+        api.report_cache.local.clear()
+        app.app.config['TESTING'] = True
+        self.app = app.app.test_client()
+        with self.app.session_transaction() as flask_session:
+            flask_session['user'] = teacher.id
+
+    def tearDown(self):
+        model.session.rollback()
+
+    def testEmptyReportsAreZeros(self):
+        context = api.ReportContext()
+        self.assertEqual([cohort["cohort_id"] for cohort in api.get_teacher_cohorts(self.teacher_id, context)],
+                         [self.cohort_id])
+        self.assertEqual(api.all_cohorts_pie_chart(self.teacher_id, context),
+                         [{"score": "M", "value": 0.0}, {"score": "A", "value": 0.0}, {"score": "FB", "value": 0.0}])
+        self.assertEqual(api.all_cohorts_most_recent_comp_to_normscores(self.teacher_id, context),
+                         [{"cohortName": "My Students", "value": 0.0}])
+        self.assertEqual(api.all_cohorts_top_struggle_standards(self.teacher_id, context), [])
+        students = api.all_cohorts_top_struggle_students(self.teacher_id, context)
+        self.assertEqual([(student["A"], student["FB"]) for student in students], [(0.0, 0.0)])
+
+    def testFailedReportIsSentAsNull(self):
+        def fail(teacher_id, context):
+            raise ZeroDivisionError("float division by zero")
+        context = api.ReportContext()
+        self.assertEqual(api._build_dashboard_report(self.teacher_id, ("allCohortsPie", fail), context), None)
+        self.assertEqual(context.errors, ["allCohortsPie"])
+
+        # The cohorts still reach the client
+        cohorts = api._build_dashboard_report(self.teacher_id, ("cohorts", api.get_teacher_cohorts), context)
+        self.assertEqual([cohort["cohort_id"] for cohort in cohorts], [self.cohort_id])
+
+    def testEmptyCohortReports(self):
+        response = self.app.get("/api/cohorts/%d/reports/" % self.cohort_id)
+        self.assertEqual(response.status_code, 200)
+        reports = [report.values()[0] for report in json.loads(response.data)["dataValues"]]
+        self.assertEqual(reports[0], [])
+        self.assertEqual([score["value"] for score in reports[1]], [0.0, 0.0, 0.0])
+        self.assertEqual(reports[2], [{"cohortName": "My Students", "value": 0.0}])
+        self.assertEqual(reports[4], [])
+        self.assertEqual(reports[6], [{"studentName": "Ed Empty", "3": 0, "2": 0, "1": 0}])
+
+    def testEmptyStudentReports(self):
+        response = self.app.get("/api/students/%d/reports/" % self.student_id)
+        self.assertEqual(response.status_code, 200)
+        reports = [report.values()[0] for report in json.loads(response.data)["dataValues"]]
+        self.assertEqual([score["value"] for score in reports[0]], [0.0, 0.0, 0.0])
+        self.assertEqual(reports[1], [])
+        self.assertEqual(reports[2], [{"cohortName": "My Students", "value": 0.0},
+                                      {"cohortName": "Ed Empty", "value": 0.0}])
+        self.assertEqual(reports[4], {"message": "scores will be compared once two tests have been uploaded."})
+        self.assertEqual(reports[5], {"count": 0})
+
+class TestReportCache(unittest.TestCase):
+
+    def testLRUCacheDropsLeastRecentlyUsed(self):
+        lru = cache.LRUCache(2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+
+    def testNewVersionRebuildsReport(self):
+        reports = cache.ReportCache(10)
+        self.assertEqual(reports.get_or_build(84, 1, "pie", lambda: [1]), [1])
+        self.assertEqual(reports.get_or_build(84, 1, "pie", lambda: [2]), [1])
+        self.assertEqual(reports.get_or_build(84, 2, "pie", lambda: [2]), [2])
+
+    def testUncacheableReportIsRebuilt(self):
+        reports = cache.ReportCache(10)
+        self.assertEqual(reports.get_or_build(84, 1, "pie", lambda: [None], lambda: False), [None])
+        self.assertEqual(reports.get_or_build(84, 1, "pie", lambda: [1], lambda: True), [1])
+        self.assertEqual(reports.get_or_build(84, 1, "pie", lambda: [2]), [1])
+
+    def testStreamedReportIsCachedWhenFinished(self):
+        reports = cache.ReportCache(10)
+        build = lambda: iter([(1, "a"), (2, (item for item in [("x", 3)]))])
+        self.assertEqual(cache.collect(reports.iter_or_build(84, 1, "students", build)), {1: "a", 2: {"x": 3}})
+        self.assertEqual(dict(reports.iter_or_build(84, 1, "students", lambda: iter([]))), {1: "a", 2: {"x": 3}})
+
+class TestReportPool(unittest.TestCase):
+
+    def testFanOutKeepsOrder(self):
+        built = api.fan_out(lambda item, context: (item, context), range(10), "context")
+        self.assertEqual(list(built), [(item, "context") for item in range(10)])
+
+    def testFailedItemIsSentAsNull(self):
+        def build(item, context):
+            return 10 / item
+        context = api.ReportContext()
+        built = api.fan_out(lambda item, context: api._build_isolated("item %d" % item, build, item, context),
+                            [5, 0, 2], context)
+        self.assertEqual(list(built), [2, None, 5])
+        self.assertEqual(context.errors, ["item 0"])
+
+class TestStreamJSON(unittest.TestCase):
+
+    def items(self):
+        # A report like all_single_cohort_data, with a streamed inner report
+        yield 6, (item for item in [("report1", [{"score": "M", "value": 50.0}]), ("report2", None)])
+        yield 7, {"report1": [], "name": u"Ms. Taylor's \"Class\"\n"}
+        yield "total", 2
+
+    def collected(self):
+        return json.loads(json.dumps(cache.collect(self.items())))
+
+    def streamedBody(self, accept_encoding):
+        with app.app.test_request_context(headers={"Accept-Encoding": accept_encoding}):
+            response = app._stream_JSON(self.items(), depth=2)
+            return response.headers.get("Content-Encoding"), "".join(response.response)
+
+    def testStreamedBodyMatchesCollect(self):
+        self.assertEqual(json.loads("".join(app._iter_JSON(self.items(), 2))), self.collected())
+        self.assertEqual(json.loads(self.streamedBody("identity")[1]), self.collected())
+
+    def testBufferJoinsChunks(self):
+        chunks = ["x" * 1000] * (app.STREAM_BUFFER_SIZE / 1000 * 3)
+        pieces = list(app._buffer(chunks))
+        self.assertEqual(len(pieces), 3)
+        self.assertEqual("".join(pieces), "".join(chunks))
+
+    def testGzipBodyDecompresses(self):
+        encoding, body = self.streamedBody("gzip")
+        self.assertEqual(encoding, "gzip")
+        self.assertEqual(json.loads(zlib.decompress(body, 16 + zlib.MAX_WBITS)), self.collected())
+
+    def testDeflateBodyDecompresses(self):
+        encoding, body = self.streamedBody("deflate")
+        self.assertEqual(encoding, "deflate")
+        self.assertEqual(json.loads(zlib.decompress(body)), self.collected())
+
+    def testCompressedChunksDecompress(self):
+        chunks = [json.dumps({"row": i}) for i in range(1000)]
+        self.assertEqual(zlib.decompress("".join(app._compress(iter(chunks), "deflate"))), "".join(chunks))
+
+    def testFirstItemFailsBeforeResponse(self):
+        def items():
+            raise ValueError("No cohorts")
+            yield
+        with app.app.test_request_context():
+            self.assertRaises(ValueError, app._stream_JSON, items())
+
+class TestJobs(unittest.TestCase):
+
+    def waitForJob(self, job_id, owner_id):
+        job = jobs.get_job(job_id, owner_id)
+        while job["status"] in ("queued", "running"):
+            time.sleep(0.01)
+            job = jobs.get_job(job_id, owner_id)
+        return job
+
+    def testJobResult(self):
+        def count(rows, progress=None):
+            progress(rows)
+            return rows
+        job = self.waitForJob(jobs.submit("Count", 84, count, 3), 84)
+        self.assertEqual((job["status"], job["result"], job["rows_processed"]), ("done", 3, 3))
+
+    def testJobOwnedByOtherTeacher(self):
+        job_id = jobs.submit("Count", 84, lambda progress=None: 0)
+        self.waitForJob(job_id, 84)
+        self.assertEqual(jobs.get_job(job_id, 85), None)
+        self.assertEqual(jobs.get_job("not-a-job", 84), None)
+
+    def testFailedJob(self):
+        def fail(progress=None):
+            raise ValueError("Row for RL.5.1 has 2 scores for 3 students.")
+        job = self.waitForJob(jobs.submit("Fail", 84, fail), 84)
+        self.assertEqual((job["status"], job["error"]), ("failed", "Row for RL.5.1 has 2 scores for 3 students."))
+
+    def testFileJobRemovesFile(self):
+        fd, file_path = tempfile.mkstemp()
+        os.close(fd)
+        job = self.waitForJob(jobs.submit_file("Upload", 84, file_path, lambda path, progress=None: path), 84)
+        self.assertEqual(job["result"], file_path)
+        self.assertFalse(os.path.exists(file_path))
+
+class TestBulkWrites(unittest.TestCase):
+
+    def testCopyValueEscapesDelimiters(self):
+        self.assertEqual(bulk._copy_value("Taylor\tTami\n"), "Taylor\\tTami\\n")
+
+    def testCopyValueNull(self):
+        self.assertEqual(bulk._copy_value(None), "\\N")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file